@@ -1,39 +1,116 @@
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import metrics
 from search_engine import (
-    search_documents_vector_space,
-    search_documents_pagerank,
-    search_documents_hits,
-    search_google_serpapi,
-    search_bing_serpapi
+    BATCH_MAX_QUERIES,
+    BATCH_MAX_TOP_K,
+    InvalidCursor,
+    PAGE_SIZE,
+    PAGINATION_DEPTH,
+    UnsupportedAlgorithm,
+    available_algorithms,
+    search_all,
+    search_documents_batch,
+    search_documents_page,
+    suggest,
 )
 
 app = Flask(__name__)
 CORS(app)
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.teardown_request
+def record_request(error):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    if error is not None:
+        metrics.REQUEST_ERRORS.inc(route=route)
+
+def count_param(data, name, default, maximum):
+    """
+    A positive integer field of a request body, clamped to maximum. Returns
+    (value, None), or (None, error message) when it is not an integer or is
+    below 1.
+    """
+    try:
+        value = int(data.get(name, default))
+    except (TypeError, ValueError):
+        return None, f"{name} must be an integer"
+    if value < 1:
+        return None, f"{name} must be at least 1"
+    return min(value, maximum), None
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/search', methods=['POST'])
 def search():
     data = request.get_json()
     query = data.get('query', '')
     algorithm = data.get('ranking_algorithm', 'tfidf')
+    # Pages never go past the depth of the cached ranking
+    page_size, error = count_param(data, 'page_size', PAGE_SIZE, PAGINATION_DEPTH)
+    if error:
+        return jsonify({"error": error}), 400
+    cursor = data.get('cursor')
+
+    # Later pages come from the custom engine's cached ranking only
+    if cursor:
+        try:
+            page = search_documents_page(query, algorithm, page_size, cursor)
+        except (InvalidCursor, UnsupportedAlgorithm) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"custom": page["results"], "next_cursor": page["next_cursor"]})
 
-    # Custom Search Engine based on algorithm
-    if algorithm == 'pagerank':
-        custom_results = search_documents_pagerank(query)
-    elif algorithm == 'hits':
-        custom_results = search_documents_hits(query)
-    else:
-        custom_results = search_documents_vector_space(query)
+    # Custom engine, Google and Bing (via SerpAPI) run concurrently with
+    # per-backend deadlines; slow or failing backends return no results
+    try:
+        return jsonify(search_all(query, algorithm, page_size))
+    except UnsupportedAlgorithm as e:
+        return jsonify({"error": str(e)}), 400
 
+@app.route('/api/capabilities')
+def capabilities():
+    # Lets the frontend offer only the ranking algorithms this index supports
+    return jsonify({"ranking_algorithms": available_algorithms()})
+
+@app.route('/api/suggest')
+def suggest_completions():
+    prefix = request.args.get('q', '')
+    limit = request.args.get('limit', 8, type=int)
+
+    # Completions precomputed at build time from titles, keywords and terms.json
+    return jsonify({"query": prefix, "suggestions": suggest(prefix, limit)})
+
+@app.route('/api/search/batch', methods=['POST'])
+def search_batch():
+    data = request.get_json()
+    queries = data.get('queries', [])
+    algorithm = data.get('ranking_algorithm', 'tfidf')
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        return jsonify({"error": "queries must be a list of strings"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"at most {BATCH_MAX_QUERIES} queries per batch"}), 400
+    top_k, error = count_param(data, 'top_k', 5, BATCH_MAX_TOP_K)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Real Google and Bing search via SerpAPI
-    google_results = search_google_serpapi(query)
-    bing_results = search_bing_serpapi(query)
+    # Custom engine only; external backends are not queried in bulk
+    try:
+        results = search_documents_batch(queries, algorithm, top_k)
+    except UnsupportedAlgorithm as e:
+        return jsonify({"error": str(e)}), 400
 
     return jsonify({
-        "custom": custom_results,
-        "google": google_results,
-        "bing": bing_results
+        "results": [
+            {"query": query, "custom": custom_results}
+            for query, custom_results in zip(queries, results)
+        ]
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,455 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import ujson as json
+import numpy as np
+from lsa import LSA_DIMENSIONS, LSA_PROBES
+
+# Ranking modes as SklearnIndexer.search flags.
+MODES = {
+    "vector": dict(use_pagerank=False, use_hits=False, use_vector_space=True),
+    "pagerank": dict(use_pagerank=True, use_hits=False, use_vector_space=False),
+    "hits": dict(use_pagerank=False, use_hits=True, use_vector_space=False),
+    "query_hits": dict(use_pagerank=False, use_hits=False, use_vector_space=False,
+                       use_query_hits=True),
+}
+IDEOLOGY_TERMS = [
+    "liberalism", "conservatism", "socialism", "libertarianism", "communism", "marxism",
+    "anarchism", "democracy", "capitalism", "freedom", "equality", "liberty", "state",
+    "market", "rights", "tradition", "class", "labor", "party", "government", "theory",
+    "history", "revolution", "property", "nation", "welfare", "economic", "social",
+]
+VOCABULARY_SIZE = 50000
+# Queries per mode, and how many of them are run first without timing.
+QUERY_COUNT = 2000
+WARMUP_QUERIES = 100
+BATCH_SIZE = 64
+# IVF probe counts the LSA mode is measured at, against an exact scan
+LSA_PROBE_SWEEP = (1, 2, 4, 8, 16, 32)
+RESULTS_PATH = "benchmark_results.json"
+
+
+# --- synthetic corpus ---
+
+def vocabulary(seed=0, size=VOCABULARY_SIZE):
+    """
+    Ideology terms followed by pronounceable made-up words. Sampled with a
+    Zipf distribution, the head of the list behaves like common topic words.
+    """
+    rng = np.random.RandomState(seed)
+    syllables = np.array([c + v for c in "bcdfghklmnprstvz" for v in "aeiou"])
+    words, seen = list(IDEOLOGY_TERMS), set(IDEOLOGY_TERMS)
+    while len(words) < size:
+        lengths = rng.randint(2, 5, size=size)
+        picks = syllables[rng.randint(0, len(syllables), size=(size, 4))]
+        for row, length in zip(picks, lengths):
+            word = "".join(row[:length])
+            if word not in seen and len(words) < size:
+                seen.add(word)
+                words.append(word)
+    return np.array(words, dtype=object)
+
+
+def page_url(doc_id, base_url=None):
+    if base_url is None:
+        return f"https://site{doc_id % 97}.example/page/{doc_id}"
+    return f"{base_url}/page/{doc_id}"
+
+
+def synthetic_page(doc_id, num_docs, words, seed=0, base_url=None):
+    """
+    The page of one synthetic document, in the crawler's web_graph shape.
+    Each document is seeded on its own so pages can be generated in any
+    order, which the crawl stand-in site relies on. Out-degrees follow a
+    power law and link targets favour low (popular) doc ids.
+    """
+    rng = np.random.RandomState((seed * 1000003 + doc_id) % 2**32)
+    picks = (rng.zipf(1.2, size=80) - 1) % len(words)
+    title_len, desc_len = rng.randint(2, 9), rng.randint(15, 60)
+    title = " ".join(words[picks[:title_len]]).title() + f" {doc_id}"
+    description = " ".join(words[picks[title_len:title_len + desc_len]]) + "."
+    keywords = ", ".join(words[picks[-4:]])
+
+    out_degree = min(int(rng.zipf(1.8)), 60)
+    popular = (rng.zipf(1.3, size=out_degree) - 1) % num_docs
+    uniform = rng.randint(0, num_docs, size=out_degree)
+    targets = np.where(rng.random_sample(out_degree) < 0.5, popular, uniform)
+    links = [page_url(int(t), base_url) for t in dict.fromkeys(targets.tolist()) if t != doc_id]
+    if rng.random_sample() < 0.1:
+        links.append(f"https://external{doc_id % 13}.example/ref/{doc_id}")
+    return {"metadata": {"title": title, "description": description, "keywords": keywords},
+            "links": links}
+
+
+def generate_corpus(num_docs, seed=0, base_url=None):
+    """
+    Yield (url, page) pairs of a synthetic corpus, streaming, so corpora up
+    to millions of pages never sit in memory.
+    """
+    words = vocabulary(seed)
+    for doc_id in range(num_docs):
+        yield page_url(doc_id, base_url), synthetic_page(doc_id, num_docs, words, seed, base_url)
+
+
+def write_corpus(directory, num_docs, seed=0):
+    """
+    Write a synthetic corpus the way the crawler does: shards of pages plus
+    the interned link graph.
+    """
+    from crawl_store import CrawlGraph, ShardWriter
+
+    writer = ShardWriter(directory)
+    graph = CrawlGraph(directory)
+    for i, (url, page) in enumerate(generate_corpus(num_docs, seed)):
+        page_id, edges = graph.add_page(url, page["links"])
+        writer.write(url, {**page, "id": page_id, "edges": edges})
+        if (i + 1) % 10000 == 0:
+            graph.flush(writer)
+            writer.flush()
+    graph.flush(writer)
+    writer.close()
+    return writer.pages_written
+
+
+def generate_queries(count, seed=0):
+    rng = np.random.RandomState(seed + 1)
+    words = vocabulary(seed)
+    lengths = rng.choice([1, 2, 3, 4], size=count, p=[0.35, 0.35, 0.2, 0.1])
+    return [" ".join(words[(rng.zipf(1.3, size=n) - 1) % 2000]) for n in lengths]
+
+
+# --- measurements ---
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 2**20
+
+
+def latency_summary(latencies, elapsed):
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        "count": len(latencies),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "qps": len(latencies) / elapsed,
+    }
+
+
+def directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 2**20
+
+
+def build_once(corpus_dir, index_dir, workers=None, lsa_dimensions=None):
+    """
+    Build and save an index in this process; meant to run in a fresh
+    subprocess so peak RSS covers the build alone.
+    """
+    from build_pipeline import build_index_parallel, iter_pages
+    from index_store import save_index
+    from sklearn_indexer import SklearnIndexer
+
+    indexer = SklearnIndexer()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages = build_index_parallel(indexer, iter_pages(corpus_dir), workers=workers,
+                                      lsa_dimensions=lsa_dimensions, graph_dir=corpus_dir)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    save_index(indexer, index_dir)
+    return {
+        "documents": indexer.num_documents(),
+        "build_seconds": build_seconds,
+        "save_seconds": time.perf_counter() - start,
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "index_size_mb": directory_size_mb(index_dir),
+    }
+
+
+def bench_build(corpus_dir, index_dir, workers=None, lsa_dimensions=None):
+    command = [sys.executable, os.path.abspath(__file__), "build-once", corpus_dir, index_dir]
+    if workers:
+        command += ["--workers", str(workers)]
+    if lsa_dimensions:
+        command += ["--lsa", str(lsa_dimensions)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_query(index_dir, count=QUERY_COUNT, seed=0, top_k=5):
+    from index_store import load_index
+
+    start = time.perf_counter()
+    indexer = load_index(index_dir)
+    results = {"load_seconds": time.perf_counter() - start}
+    queries = generate_queries(count + WARMUP_QUERIES, seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for mode, flags in MODES.items():
+            for query in queries[:WARMUP_QUERIES]:
+                indexer.search(query, top_k=top_k, **flags)
+            latencies = []
+            started = time.perf_counter()
+            for query in queries[WARMUP_QUERIES:]:
+                t = time.perf_counter()
+                indexer.search(query, top_k=top_k, **flags)
+                latencies.append(time.perf_counter() - t)
+            results[mode] = latency_summary(latencies, time.perf_counter() - started)
+
+        latencies = []
+        started = time.perf_counter()
+        batch_queries = queries[WARMUP_QUERIES:]
+        for i in range(0, len(batch_queries), BATCH_SIZE):
+            t = time.perf_counter()
+            indexer.search_batch(batch_queries[i:i + BATCH_SIZE], top_k=top_k)
+            latencies.append(time.perf_counter() - t)
+        summary = latency_summary(latencies, time.perf_counter() - started)
+        summary["qps"] *= BATCH_SIZE
+        results[f"batch_{BATCH_SIZE}"] = summary
+
+        if indexer.lsa is not None:
+            results["lsa"] = bench_lsa(indexer, queries, top_k)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def bench_lsa(indexer, queries, top_k=5):
+    """
+    LSA latency and recall@k at each IVF probe count, where recall is the
+    share of the exact scan's top k that the probed search also returns.
+    """
+    def top_ids(query):
+        return [doc["url"] for doc in indexer.search(query, False, False, False,
+                                                     top_k=top_k, use_lsa=True)]
+
+    lsa = indexer.lsa
+    num_lists = 0 if lsa.centroids is None else len(lsa.centroids)
+    lsa.probes = max(num_lists, 1)
+    exact = [set(top_ids(query)) for query in queries[WARMUP_QUERIES:]]
+    results = {"lists": num_lists}
+    for probes in [p for p in LSA_PROBE_SWEEP if p < num_lists] + [max(num_lists, 1)]:
+        lsa.probes = probes
+        for query in queries[:WARMUP_QUERIES]:
+            top_ids(query)
+        latencies, found, wanted = [], 0, 0
+        started = time.perf_counter()
+        for query, expected in zip(queries[WARMUP_QUERIES:], exact):
+            t = time.perf_counter()
+            ids = top_ids(query)
+            latencies.append(time.perf_counter() - t)
+            found += len(expected.intersection(ids))
+            wanted += len(expected)
+        summary = latency_summary(latencies, time.perf_counter() - started)
+        summary["recall"] = found / wanted if wanted else 1.0
+        results[f"probes_{probes}"] = summary
+    lsa.probes = LSA_PROBES
+    return results
+
+
+# --- crawl against a local stand-in site ---
+
+def _serve_site(num_docs, seed, ready):
+    from aiohttp import web
+
+    words = vocabulary(seed)
+
+    async def page(request):
+        doc_id = int(request.match_info["doc_id"])
+        base_url = f"http://{request.host}"
+        data = synthetic_page(doc_id, num_docs, words, seed, base_url)
+        meta = data["metadata"]
+        links = "".join(f'<li><a href="{link}">{i}</a></li>' for i, link in enumerate(data["links"]))
+        body = (f'<html lang="en"><head><title>{meta["title"]}</title>'
+                f'<meta name="description" content="{meta["description"]}">'
+                f'<meta name="keywords" content="{meta["keywords"]}"></head>'
+                f'<body><p>{meta["description"]}</p><ul>{links}</ul></body></html>')
+        return web.Response(text=body, content_type="text/html")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/page/{doc_id}", page)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        ready.put(sock.getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def bench_crawl(num_docs, max_pages, seed=0, concurrent_tasks=50):
+    """
+    Crawl pages/sec of WebCrawler against a local aiohttp site serving the
+    synthetic corpus from another process. Politeness delays are turned
+    off, since every page comes from one local host.
+    """
+    from web_crawler import WebCrawler
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve_site, args=(num_docs, seed, ready), daemon=True)
+    server.start()
+    try:
+        port = ready.get(timeout=30)
+        with tempfile.TemporaryDirectory() as output_dir:
+            crawler = WebCrawler([page_url(0, f"http://127.0.0.1:{port}")], max_pages=max_pages,
+                                 concurrent_tasks=concurrent_tasks, output_dir=output_dir)
+            crawler.frontier.host_delay = 0.0
+            crawler.frontier.host_connections = concurrent_tasks
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(crawler.crawl())
+            elapsed = time.perf_counter() - start
+            return {
+                "pages_crawled": crawler.pages_crawled,
+                "pages_written": crawler.output.pages_written,
+                "seconds": elapsed,
+                "pages_per_second": crawler.pages_crawled / elapsed,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+    finally:
+        server.terminate()
+
+
+# --- results ---
+
+def run_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _flatten(tree, prefix=""):
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old_path, new_path):
+    """
+    Print every numeric result of two runs side by side with new/old ratios.
+    """
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = _flatten(json.load(f)["results"])
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = _flatten(json.load(f)["results"])
+    width = max(map(len, old.keys() | new.keys()), default=0)
+    for name in sorted(old.keys() | new.keys()):
+        a, b = old.get(name), new.get(name)
+        ratio = f"{b / a:8.3f}x" if a and b is not None else ""
+        print(f"{name:<{width}}  {_number(a):>12}  {_number(b):>12}  {ratio}")
+
+
+def _number(value):
+    return "-" if value is None else f"{value:.6g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawl, index build and query paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run benchmarks and write a JSON results file")
+    run.add_argument("--docs", type=int, default=10000, help="synthetic corpus size (1k to 1M)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--only", nargs="*", choices=["build", "query", "crawl"],
+                     default=["build", "query", "crawl"])
+    run.add_argument("--queries", type=int, default=QUERY_COUNT)
+    run.add_argument("--crawl-pages", type=int, default=2000)
+    run.add_argument("--workers", type=int, default=None, help="build tokenizer processes")
+    run.add_argument("--lsa", type=int, nargs="?", const=LSA_DIMENSIONS, default=None,
+                     metavar="DIMENSIONS", help="also build LSA embeddings and benchmark the lsa mode")
+    run.add_argument("--workdir", default=None, help="keep the corpus and index here (default: a temp dir)")
+    run.add_argument("--output", default=RESULTS_PATH)
+
+    corpus = commands.add_parser("corpus", help="write a synthetic corpus as crawl output shards")
+    corpus.add_argument("directory")
+    corpus.add_argument("--docs", type=int, default=10000)
+    corpus.add_argument("--seed", type=int, default=0)
+
+    once = commands.add_parser("build-once")
+    once.add_argument("corpus_dir")
+    once.add_argument("index_dir")
+    once.add_argument("--workers", type=int, default=None)
+    once.add_argument("--lsa", type=int, default=None)
+
+    diff = commands.add_parser("compare", help="compare two results files")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "corpus":
+        print(f"✅ Wrote {write_corpus(args.directory, args.docs, args.seed)} pages to {args.directory}/")
+    elif args.command == "build-once":
+        print(json.dumps(build_once(args.corpus_dir, args.index_dir, args.workers, args.lsa)))
+    elif args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        with contextlib.ExitStack() as stack:
+            workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+            corpus_dir = os.path.join(workdir, "corpus")
+            index_dir = os.path.join(workdir, "sklearn_index")
+            results = {}
+            if {"build", "query"} & set(args.only):
+                if not os.path.isdir(corpus_dir):
+                    start = time.perf_counter()
+                    write_corpus(corpus_dir, args.docs, args.seed)
+                    print(f"📄 Generated {args.docs} pages in {time.perf_counter() - start:.2f}s")
+                if "build" in args.only or not os.path.isdir(index_dir):
+                    results["build"] = bench_build(corpus_dir, index_dir, args.workers, args.lsa)
+                    print(f"🔧 build: {results['build']['build_seconds']:.2f}s, "
+                          f"peak RSS {results['build']['peak_rss_mb']:.0f} MB")
+            if "query" in args.only:
+                results["query"] = bench_query(index_dir, args.queries, args.seed)
+                for mode in MODES:
+                    summary = results["query"][mode]
+                    print(f"🔍 {mode}: p50 {summary['p50_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms, "
+                          f"{summary['qps']:.0f} QPS")
+                for name, summary in results["query"].get("lsa", {}).items():
+                    if name.startswith("probes_"):
+                        print(f"🧭 lsa {name}: p50 {summary['p50_ms']:.2f}ms, "
+                              f"recall@5 {summary['recall']:.3f}")
+            if "crawl" in args.only:
+                results["crawl"] = bench_crawl(args.docs, args.crawl_pages, args.seed)
+                print(f"🕷️  crawl: {results['crawl']['pages_per_second']:.0f} pages/s")
+
+        report = {"meta": run_metadata(),
+                  "params": {key: value for key, value in vars(args).items() if key != "command"},
+                  "results": results}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, escape_forward_slashes=False)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import os
+import pickle
+import time
+import ujson as json
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from crawl_store import has_graph, read_graph_edges, read_graph_urls, read_shard, read_shards
+from graph_rank import ExternalLinks, LinkIndex, adjacency_from_edges, edge_array, pagerank, hits
+from index_store import DocStoreWriter
+from inverted_index import InvertedIndex
+from lsa import LsaIndex
+from suggest import SuggestIndex
+from near_duplicates import NearDuplicateIndex, fingerprint
+
+# Field matrices built by the pipeline, in the order texts are sent to workers.
+BUILD_FIELDS = ("title", "body")
+# Field matrices are stored in single precision; scores are still summed in
+# double precision at query time.
+MATRIX_DTYPE = np.float32
+# Documents per tokenization task, and tasks in flight per worker. Together
+# they bound how much raw text is held in memory at once.
+CHUNK_SIZE = 2000
+INFLIGHT_PER_WORKER = 2
+
+
+class StageTimer:
+    """
+    Wall-clock timings of named build stages, printed as each one finishes.
+    Stages may run concurrently in different threads.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        yield
+        self.timings[name] = time.time() - start
+        print(f"⏱️  {name}: {self.timings[name]:.2f}s")
+
+
+def iter_pages(path):
+    """
+    Yield (url, page) pairs from crawl output. The crawler's shard directory,
+    a single .jsonl.gz shard and plain JSON Lines files (one {"url",
+    "metadata", "links"} record per line) are streamed; a pickled or JSON
+    scraped_data dict has to be loaded whole first.
+    """
+    if os.path.isdir(path):
+        yield from read_shards(path)
+        return
+    if path.endswith(".jsonl.gz"):
+        yield from read_shard(path)
+        return
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.pop("url"), record
+        return
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            scraped_data = pickle.load(f)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            scraped_data = json.load(f)
+    yield from scraped_data["web_graph"].items()
+
+
+# --- tokenization (runs in worker processes) ---
+
+_analyzer = None
+
+
+def _init_worker(stop_words):
+    global _analyzer
+    _analyzer = TfidfVectorizer(stop_words=stop_words).build_analyzer()
+
+
+def _count_chunk(texts):
+    """
+    Term counts for a chunk of (title, body) texts. Returns per field the
+    chunk's terms in first-occurrence order and a CSR count matrix over those
+    local term ids.
+    """
+    counted = []
+    for field_idx in range(len(BUILD_FIELDS)):
+        vocabulary = {}
+        indptr, indices, data = [0], [], []
+        for doc in texts:
+            for term, count in Counter(_analyzer(doc[field_idx])).items():
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+        counts = sp.csr_matrix(
+            (np.asarray(data, dtype=np.int64), np.asarray(indices, dtype=np.int64), indptr),
+            shape=(len(texts), len(vocabulary)),
+        )
+        counted.append((list(vocabulary), counts))
+    return counted
+
+
+# --- assembly (main process) ---
+
+class _FieldBuilder:
+    """
+    Merges chunk count matrices into one corpus matrix, numbering terms by
+    first occurrence across the corpus exactly like CountVectorizer does.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.chunks = []
+
+    def add(self, terms, counts):
+        vocabulary = self.vocabulary
+        remap = np.fromiter((vocabulary.setdefault(term, len(vocabulary)) for term in terms),
+                            dtype=np.int64, count=len(terms))
+        counts.indices = remap[counts.indices] if len(terms) else counts.indices
+        self.chunks.append(counts)
+
+    def finish(self, stop_words):
+        """
+        Return (vectorizer, tfidf matrix) equal to TfidfVectorizer.fit_transform
+        over the same documents.
+        """
+        if not self.vocabulary:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        num_terms = len(self.vocabulary)
+        chunks = []
+        for counts in self.chunks:
+            counts.resize((counts.shape[0], num_terms))
+            chunks.append(counts)
+        X = sp.vstack(chunks, format="csr")
+        self.chunks = []
+        X.sort_indices()
+
+        # Renumber terms alphabetically (CountVectorizer._sort_features)
+        sorted_terms = sorted(self.vocabulary.items())
+        map_index = np.empty(num_terms, dtype=X.indices.dtype)
+        vocabulary = {}
+        for new_id, (term, old_id) in enumerate(sorted_terms):
+            vocabulary[term] = new_id
+            map_index[old_id] = new_id
+        # Rows keep their entries in first-occurrence order, as in
+        # CountVectorizer, since the L2 norms below are summed in that order.
+        X.indices = map_index.take(X.indices, mode="clip")
+        X.data = X.data.astype(np.float64)
+
+        # Smoothed IDF and L2 normalization (TfidfTransformer)
+        n_samples = X.shape[0] + 1
+        df = np.bincount(X.indices, minlength=num_terms).astype(np.float64) + 1.0
+        idf = np.full_like(df, fill_value=n_samples)
+        idf /= df
+        np.log(idf, out=idf)
+        idf += 1.0
+        X.data *= idf[X.indices]
+        X = normalize(X, norm="l2", copy=False)
+        X.data = X.data.astype(MATRIX_DTYPE)
+        if X.nnz < np.iinfo(np.int32).max:
+            X.indices = X.indices.astype(np.int32)
+            X.indptr = X.indptr.astype(np.int32)
+
+        vectorizer = TfidfVectorizer(stop_words=stop_words, vocabulary=vocabulary)
+        vectorizer.idf_ = idf
+        return vectorizer, X
+
+
+def build_index_parallel(indexer, pages, workers=None, chunk_size=CHUNK_SIZE,
+                         collapse_near_duplicates=True, lsa_dimensions=None, graph_dir=None):
+    """
+    Build `indexer` from an iterable of (url, page) pairs in the crawler's
+    web_graph shape, reading it once. Tokenization runs in a process pool
+    while pages are still being read, the field matrices are finished in
+    parallel, and link analysis runs alongside them. Repeated urls keep their
+    first occurrence. With collapse_near_duplicates, a page whose title and
+    description nearly match an earlier page's is left out and links to it
+    count for that page instead. With lsa_dimensions, LSA embeddings of that
+    many dimensions per field are fitted as well. If graph_dir holds the
+    crawler's link graph, the links of pages carrying a graph id and edge
+    range are read from it rather than from their url lists. Returns the per-stage timings.
+    """
+    from sklearn_indexer import field_texts
+
+    timer = StageTimer()
+    workers = workers or os.cpu_count() or 1
+    builders = {field: _FieldBuilder() for field in BUILD_FIELDS}
+
+    # Every url seen, as a page or a link target, gets a provisional id so
+    # links are kept as integer pairs instead of lists of strings. With a
+    # crawl graph, its url ids are used, and other urls are numbered after
+    # them once a page without a graph id turns up.
+    graph_edges = None
+    if graph_dir is not None and os.path.isdir(graph_dir) and has_graph(graph_dir):
+        graph_edges = read_graph_edges(graph_dir)
+    url_ids = {}
+    indexed = set()
+    documents = DocStoreWriter()
+    page_ids = array('q')
+    # (doc id, start, stop) of the crawl graph edges of indexed pages
+    graph_ranges = array('q')
+    link_sources = array('q')
+    link_targets = array('q')
+    near_duplicates = NearDuplicateIndex() if collapse_near_duplicates else None
+    # (provisional url id, doc id) of collapsed pages and the page they duplicate
+    aliases = array('q')
+
+    def merge(counted):
+        for field, (terms, counts) in zip(BUILD_FIELDS, counted):
+            builders[field].add(terms, counts)
+
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                               initargs=(indexer.stop_words,)) if workers > 1 else None
+    if pool is None:
+        _init_worker(indexer.stop_words)
+    inflight = deque()
+    chunk = []
+
+    def submit(chunk):
+        if pool is None:
+            merge(_count_chunk(chunk))
+            return
+        inflight.append(pool.submit(_count_chunk, chunk))
+        # Results are merged in submission order so term numbering is stable
+        while len(inflight) >= workers * INFLIGHT_PER_WORKER:
+            merge(inflight.popleft().result())
+
+    try:
+        with timer.stage("read + tokenize"):
+            for url, data in pages:
+                if url in indexed:
+                    continue
+                doc_id = len(page_ids)
+                metadata = data.get("metadata", {})
+                url_id = data.get("id") if graph_edges is not None else None
+                edge_range = data.get("edges")
+                if url_id is None or edge_range is None:
+                    if graph_edges is not None and not url_ids:
+                        url_ids = {u: i for i, u in enumerate(read_graph_urls(graph_dir))}
+                    url_id = url_ids.setdefault(url, len(url_ids))
+                    links = data.get("links", [])
+                    edge_range = None
+                else:
+                    links = ()
+                if near_duplicates is not None:
+                    original = near_duplicates.check_add(fingerprint(metadata), doc_id)
+                    if original is not None:
+                        aliases.extend((url_id, original))
+                        continue
+                indexed.add(url)
+                documents.add(url, metadata)
+                page_ids.append(url_id)
+                if edge_range is not None:
+                    graph_ranges.extend((doc_id, edge_range[0], edge_range[1]))
+                for out_url in links:
+                    link_sources.append(doc_id)
+                    link_targets.append(url_ids.setdefault(out_url, len(url_ids)))
+
+                title_text, body_text = field_texts(metadata)
+                chunk.append((title_text, body_text))
+                if len(chunk) >= chunk_size:
+                    submit(chunk)
+                    chunk = []
+            if chunk:
+                submit(chunk)
+
+            # Link analysis only needs ids, so it starts while the last
+            # chunks are still being tokenized.
+            threads = ThreadPoolExecutor(max_workers=len(BUILD_FIELDS) + 1)
+            graph_future = threads.submit(_rank_links, indexer, timer, page_ids, aliases,
+                                          link_sources, link_targets, url_ids, graph_edges,
+                                          graph_ranges, graph_dir)
+            while inflight:
+                merge(inflight.popleft().result())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    indexer.doc_store = documents.finish()
+    if aliases:
+        print(f"🧹 Collapsed {len(aliases) // 2} near-duplicate pages")
+
+    def finish(field):
+        with timer.stage(f"{field} matrix"):
+            return builders[field].finish(indexer.stop_words)
+
+    def fit_lsa():
+        with timer.stage("lsa"):
+            return LsaIndex.fit({"title": indexer.title_tfidf_matrix,
+                                 "body": indexer.body_tfidf_matrix}, lsa_dimensions)
+
+    with threads:
+        field_futures = {field: threads.submit(finish, field) for field in BUILD_FIELDS}
+        indexer.title_vectorizer, indexer.title_tfidf_matrix = field_futures["title"].result()
+        indexer.body_vectorizer, indexer.body_tfidf_matrix = field_futures["body"].result()
+        if lsa_dimensions:
+            lsa_future = threads.submit(fit_lsa)
+        with timer.stage("inverted index"):
+            indexer.inverted_index = InvertedIndex.from_matrices(indexer.title_tfidf_matrix,
+                                                                 indexer.body_tfidf_matrix)
+        if lsa_dimensions:
+            indexer.lsa = lsa_future.result()
+        graph_future.result()
+    with timer.stage("suggest"):
+        indexer.suggestions = SuggestIndex.build(indexer)
+    return timer.timings
+
+
+def _rank_links(indexer, timer, page_ids, aliases, link_sources, link_targets, url_ids,
+                graph_edges=None, graph_ranges=(), graph_dir=None):
+    with timer.stage("link graph"):
+        page_ids = np.frombuffer(page_ids, dtype=np.int64)
+        aliases = np.frombuffer(aliases, dtype=np.int64).reshape(-1, 2)
+        if graph_edges is None:
+            graph_edges = np.empty((0, 2), dtype=np.uint32)
+        num_urls = max(len(url_ids), int(page_ids.max(initial=-1)) + 1,
+                       int(aliases[:, 0].max(initial=-1)) + 1, int(graph_edges.max(initial=0)) + 1)
+        # Provisional url id -> doc id, or -1 for pages that were not indexed
+        doc_ids = np.full(num_urls, -1, dtype=np.int64)
+        doc_ids[page_ids] = np.arange(len(page_ids))
+        sources = np.frombuffer(link_sources, dtype=np.int64)
+        targets = np.frombuffer(link_targets, dtype=np.int64)
+        if len(graph_ranges):
+            # Links of the crawl graph: the edges of each indexed record only,
+            # so a page written again keeps the links of the record indexed
+            ranges = np.frombuffer(graph_ranges, dtype=np.int64).reshape(-1, 3)
+            lengths = ranges[:, 2] - ranges[:, 1]
+            positions = (np.arange(lengths.sum())
+                         - np.repeat(np.cumsum(lengths) - lengths - ranges[:, 1], lengths))
+            sources = np.concatenate([sources, np.repeat(ranges[:, 0], lengths)])
+            targets = np.concatenate([targets, graph_edges[positions, 1].astype(np.int64)])
+        doc_ids[aliases[:, 0]] = aliases[:, 1]
+        url_targets, targets = targets, doc_ids[targets]
+        indexed = targets >= 0
+        _link_analysis(indexer, adjacency_from_edges(sources[indexed], targets[indexed],
+                                                     len(page_ids)))
+        # Links to pages that were not indexed are kept by url
+        indexer.external_links = ExternalLinks.from_pairs(
+            sources[~indexed], url_targets[~indexed], len(page_ids),
+            lambda ids: _url_names(ids, url_ids, graph_dir))
+
+
+def _url_names(ids, url_ids, graph_dir):
+    # Urls of provisional url ids: url_ids holds every url once a page
+    # without a graph id was read, else they are the crawl graph's
+    ids = ids.tolist()
+    if not ids:
+        return []
+    if not url_ids:
+        graph_urls = read_graph_urls(graph_dir)
+        return [graph_urls[i] for i in ids]
+    names = dict.fromkeys(ids)
+    for url, url_id in url_ids.items():
+        if url_id in names:
+            names[url_id] = url
+    return [names[i] for i in ids]
+
+
+def _link_analysis(indexer, adjacency):
+    indexer.edges = edge_array(adjacency)
+    indexer.link_index = LinkIndex.from_adjacency(adjacency)
+    indexer.pr_scores = pagerank(adjacency, alpha=0.85)
+    indexer.hubs, indexer.authorities = hits(adjacency)
+
+
+def build_from_segments(indexer):
+    """
+    A built (unsegmented) indexer over the live documents of a segmented
+    one, with the field matrices, posting lists and link analysis a full
+    rebuild of those documents would give. The build-time matrices of a
+    segmented indexer no longer match its doc ids, so this is what gets
+    saved.
+    """
+    from sklearn_indexer import SklearnIndexer
+
+    urls, metadata, links, counts, adjacency = indexer.segments.compact()
+    built = SklearnIndexer()
+    built.stop_words = indexer.stop_words
+    built.term_boosts = indexer.term_boosts
+    built.doc_store = DocStoreWriter.encode(zip(urls, metadata))
+    for field in BUILD_FIELDS:
+        builder = _FieldBuilder()
+        builder.add(*counts[field])
+        vectorizer, matrix = builder.finish(indexer.stop_words)
+        setattr(built, field + "_vectorizer", vectorizer)
+        setattr(built, field + "_tfidf_matrix", matrix)
+    built.inverted_index = InvertedIndex.from_matrices(built.title_tfidf_matrix,
+                                                       built.body_tfidf_matrix)
+    _link_analysis(built, adjacency)
+    positions = {url: doc_id for doc_id, url in enumerate(urls)}
+    url_ids, sources, targets = {}, array('q'), array('q')
+    for doc_id, out_urls in enumerate(links):
+        for out_url in out_urls:
+            if out_url not in positions:
+                sources.append(doc_id)
+                targets.append(url_ids.setdefault(out_url, len(url_ids)))
+    external_urls = list(url_ids)
+    built.external_links = ExternalLinks.from_pairs(
+        np.frombuffer(sources, dtype=np.int64), np.frombuffer(targets, dtype=np.int64), len(urls),
+        lambda ids: [external_urls[i] for i in ids.tolist()])
+    built.suggestions = SuggestIndex.build(built)
+    return built
@@ -0,0 +1,269 @@
+import gzip
+import os
+import pickle
+import re
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ujson as json
+
+CRAWL_DIR = "crawl_output"
+# Where --refresh crawls write the pages that changed; update_sklearn_index.py
+# applies them on top of the index built from CRAWL_DIR.
+REFRESH_DIR = "crawl_refresh"
+SHARD_PATTERN = re.compile(r"pages-(\d+)\.jsonl\.gz$")
+# Pages per shard before the writer rotates to a new file.
+SHARD_PAGES = 50000
+# Crawler state kept next to the shards: the resumable checkpoint, and the
+# per-url validators (etag, last_modified, content_hash) of refresh crawls.
+CHECKPOINT = "checkpoint.pkl"
+VALIDATORS = "validators"
+# The crawl's link graph with urls interned to ids: one url per line, its
+# line number being its id, and (page id, link target id) uint32 pairs.
+GRAPH_URLS = "urls.txt"
+GRAPH_EDGES = "edges.u32"
+
+
+def shard_name(number):
+    return f"pages-{number:06d}.jsonl.gz"
+
+
+def list_shards(directory):
+    """
+    Shard file paths in `directory`, in the order they were written.
+    """
+    if not os.path.isdir(directory):
+        return []
+    numbered = []
+    for name in os.listdir(directory):
+        match = SHARD_PATTERN.match(name)
+        if match:
+            numbered.append((int(match.group(1)), name))
+    return [os.path.join(directory, name) for _, name in sorted(numbered)]
+
+
+class ShardWriter:
+    """
+    Append-only crawl output: one JSON record per page, gzip-compressed, in
+    rotating shard files.
+
+    write() only buffers the record. flush() hands the buffer to a single
+    background thread that compresses it as one gzip member, appends it to
+    the current shard and fsyncs, so the event loop never waits on disk and
+    batches land in write order. A crash can at worst tear the last member of
+    the last shard, which read_shards skips.
+    """
+
+    def __init__(self, directory=CRAWL_DIR, shard_pages=SHARD_PAGES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_pages = shard_pages
+        existing = list_shards(directory)
+        # Never append to a shard a previous run may have left torn
+        self.shard_number = int(SHARD_PATTERN.search(existing[-1]).group(1)) + 1 if existing else 0
+        self.shard_count = 0
+        self.pages_written = 0
+        self._buffer = []
+        self._io = ThreadPoolExecutor(max_workers=1)
+
+    def write(self, url, page):
+        self._buffer.append(json.dumps({"url": url, **page}))
+
+    def flush(self):
+        """
+        Queue the buffered records for writing. Returns a concurrent future
+        that resolves once they are on disk; await it with
+        asyncio.wrap_future to wait for durability.
+        """
+        records, self._buffer = self._buffer, []
+        return self._io.submit(self._append, records)
+
+    def run(self, fn, *args):
+        """
+        Run fn on the writer thread once everything flushed so far is on
+        disk.
+        """
+        return self._io.submit(fn, *args)
+
+    def close(self):
+        self.flush()
+        self._io.shutdown(wait=True)
+
+    def _append(self, records):
+        while records:
+            if self.shard_count >= self.shard_pages:
+                self.shard_number += 1
+                self.shard_count = 0
+            batch = records[:self.shard_pages - self.shard_count]
+            records = records[len(batch):]
+            payload = gzip.compress(("\n".join(batch) + "\n").encode("utf-8"))
+            path = os.path.join(self.directory, shard_name(self.shard_number))
+            with open(path, "ab") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self.shard_count += len(batch)
+            self.pages_written += len(batch)
+
+
+def write_checkpoint(directory, payload):
+    """
+    Atomically replace the crawl checkpoint in `directory` with the pickled
+    bytes `payload`.
+    """
+    path = os.path.join(directory, CHECKPOINT)
+    with open(path + ".tmp", "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(directory):
+    path = os.path.join(directory, CHECKPOINT)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def read_shard(path):
+    """
+    Yield (url, page) pairs from one shard, stopping quietly at a torn final
+    gzip member or partial line left by a crash.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                yield record.pop("url"), record
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            print(f"⚠️ {path} ends in a truncated record; skipped the rest")
+
+
+def read_shards(directory=CRAWL_DIR):
+    """
+    Stream every page the crawler wrote to `directory`, oldest shard first.
+    """
+    for path in list_shards(directory):
+        yield from read_shard(path)
+
+
+class CrawlGraph:
+    """
+    Link graph of a crawl with urls interned to integer ids. A url, page or
+    link target, gets the next id the first time it is seen, and a page's
+    links are recorded each time it is written, as (page id, target id) pairs
+    in a uint32 array instead of a list of url strings. The page's record
+    keeps the range of its edges, so a page fetched again gets its new links
+    rather than the ones of its first fetch.
+
+    Urls and edges added since the last flush() are appended to GRAPH_URLS
+    and GRAPH_EDGES in `directory`; a graph already there is continued, up
+    to the last complete url and edge.
+    """
+
+    def __init__(self, directory=CRAWL_DIR):
+        self.directory = directory
+        self.ids = {}
+        # 1 for the ids of pages whose links are recorded
+        self.linked = bytearray()
+        self.pages = 0
+        self.num_edges = 0
+        self._new_urls = []
+        self._edges = array('I')
+        os.makedirs(directory, exist_ok=True)
+        for url in read_graph_urls(directory, repair=True):
+            self.ids[url] = len(self.ids)
+        self.linked.extend(bytes(len(self.ids)))
+        sources = read_graph_edges(directory, repair=True)[:, 0]
+        self.num_edges = len(sources)
+        for page_id in np.unique(sources).tolist():
+            self.linked[page_id] = 1
+        self.pages = int(np.count_nonzero(np.frombuffer(self.linked, dtype=np.uint8)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, url):
+        url_id = self.ids.get(url)
+        if url_id is None:
+            url_id = self.ids[url] = len(self.ids)
+            self._new_urls.append(url)
+            self.linked.append(0)
+        return url_id
+
+    def add_page(self, url, links):
+        """
+        Intern a page's url and links and record the links. Returns the
+        page's id and the [start, stop) range of its edges, which its record
+        keeps as "id" and "edges".
+        """
+        page_id = self.intern(url)
+        if not self.linked[page_id]:
+            self.linked[page_id] = 1
+            self.pages += 1
+        start = self.num_edges
+        edges = self._edges
+        for link in links:
+            edges.append(page_id)
+            edges.append(self.intern(link))
+        self.num_edges = start + len(links)
+        return page_id, [start, self.num_edges]
+
+    def flush(self, writer):
+        """
+        Queue the urls and edges added since the last flush for appending on
+        `writer`'s (a ShardWriter) thread. Flush before the writer itself,
+        so every page id in a shard is on disk first.
+        """
+        urls, edges = self._new_urls, self._edges
+        self._new_urls, self._edges = [], array('I')
+        return writer.run(self._append, urls, edges)
+
+    def _append(self, urls, edges):
+        for name, payload in ((GRAPH_URLS, "".join(url.replace("\n", "%0A") + "\n" for url in urls)
+                               .encode("utf-8")),
+                              (GRAPH_EDGES, edges.tobytes())):
+            with open(os.path.join(self.directory, name), "ab") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def has_graph(directory):
+    return os.path.exists(os.path.join(directory, GRAPH_URLS))
+
+
+def read_graph_urls(directory, repair=False):
+    """
+    Urls of a crawl graph in id order. A partial last line left by a crash
+    is ignored, or cut off with repair=True.
+    """
+    path = os.path.join(directory, GRAPH_URLS)
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    if repair and end < len(data):
+        os.truncate(path, end)
+    return data[:end].decode("utf-8").split("\n")[:-1]
+
+
+def read_graph_edges(directory, repair=False):
+    """
+    (num_edges x 2) uint32 array of the (page id, target id) pairs of a
+    crawl graph, without a torn last pair.
+    """
+    path = os.path.join(directory, GRAPH_EDGES)
+    if not os.path.exists(path):
+        return np.empty((0, 2), dtype=np.uint32)
+    size = os.path.getsize(path)
+    end = size - size % 8
+    if repair and end < size:
+        os.truncate(path, end)
+    return np.fromfile(path, dtype=np.uint32, count=end // 4).reshape(-1, 2)
@@ -0,0 +1,232 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Defaults match the networkx calls build_index used before: nx.pagerank's
+# alpha/tol/max_iter and nx.hits' tol.
+PAGERANK_ALPHA = 0.85
+PAGERANK_TOL = 1.0e-6
+PAGERANK_MAX_ITER = 100
+HITS_TOL = 1.0e-8
+HITS_MAX_ITER = 100
+# Query-time HITS: in-links followed per root page (Kleinberg's d), the size
+# cap of the expanded subgraph, and its iteration limit. The limit is a count,
+# not a time, so a query ranks the same however loaded the machine is.
+QUERY_HITS_IN_LINKS = 50
+QUERY_HITS_MAX_NODES = 5000
+QUERY_HITS_MAX_ITER = 20
+
+
+def adjacency_from_edges(sources, targets, num_nodes):
+    """
+    CSR adjacency matrix (from_id x to_id) of the given edges. Repeated
+    links collapse into one edge, as in a DiGraph.
+    """
+    adjacency = sp.csr_matrix(
+        (np.ones(len(sources)), (sources, targets)), shape=(num_nodes, num_nodes)
+    )
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1.0
+    return adjacency
+
+
+def edge_array(adjacency):
+    # (from_id, to_id) rows, the form the index directory stores
+    coo = adjacency.tocoo()
+    return np.column_stack([coo.row, coo.col]).astype(np.int64)
+
+
+def _linked_nodes(adjacency):
+    # Only pages with at least one link in or out take part, like the nodes of
+    # a graph built edge by edge; the rest score 0.
+    degree = np.diff(adjacency.indptr) + np.bincount(adjacency.indices,
+                                                     minlength=adjacency.shape[0])
+    return np.flatnonzero(degree)
+
+
+def _start_vector(start, nodes):
+    if start is None:
+        return np.full(nodes.size, 1.0 / nodes.size)
+    x = np.asarray(start, dtype=float)[nodes]
+    total = x.sum()
+    if total <= 0:
+        return np.full(nodes.size, 1.0 / nodes.size)
+    return x / total
+
+
+def pagerank(adjacency, alpha=PAGERANK_ALPHA, tol=PAGERANK_TOL, max_iter=PAGERANK_MAX_ITER,
+             start=None):
+    """
+    PageRank by power iteration on the sparse transition matrix. Dangling
+    pages spread their rank uniformly. start warm-starts the iteration from a
+    previous score array. Returns a float array indexed by doc id.
+    """
+    num_nodes = adjacency.shape[0]
+    scores = np.zeros(num_nodes)
+    nodes = _linked_nodes(adjacency)
+    if nodes.size == 0:
+        return scores
+
+    sub = adjacency[nodes][:, nodes]
+    n = nodes.size
+    out_degree = np.asarray(sub.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inv_degree = np.zeros(n)
+    inv_degree[~dangling] = 1.0 / out_degree[~dangling]
+    # transition.T @ x is x @ (D^-1 A), the rank pushed along every link
+    transition_t = (sp.diags(inv_degree) @ sub).T.tocsr()
+
+    x = _start_vector(start, nodes)
+    teleport = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        last = x
+        x = alpha * (transition_t @ x + x[dangling].sum() * teleport) + (1 - alpha) * teleport
+        if np.abs(x - last).sum() < n * tol:
+            break
+    else:
+        print(f"⚠️ PageRank did not converge in {max_iter} iterations")
+
+    scores[nodes] = x
+    return scores
+
+
+def hits(adjacency, tol=HITS_TOL, max_iter=HITS_MAX_ITER, start=None):
+    """
+    HITS hub and authority scores by power iteration, each normalized to sum
+    to 1. start warm-starts from previous hub scores. Returns two float arrays
+    (hubs, authorities) indexed by doc id.
+    """
+    num_nodes = adjacency.shape[0]
+    hubs = np.zeros(num_nodes)
+    authorities = np.zeros(num_nodes)
+    nodes = _linked_nodes(adjacency)
+    if nodes.size == 0:
+        return hubs, authorities
+
+    sub = adjacency[nodes][:, nodes].tocsr()
+    sub_t = sub.T.tocsr()
+
+    h = _start_vector(start, nodes)
+    for _ in range(max_iter):
+        last = h
+        a = sub_t @ h
+        a /= a.max()
+        h = sub @ a
+        h /= h.max()
+        if np.abs(h - last).sum() < tol:
+            break
+
+    hubs[nodes] = h / h.sum()
+    authorities[nodes] = a / a.sum()
+    return hubs, authorities
+
+
+class LinkIndex:
+    """
+    Out-link and in-link lists of every page as two CSR structures over doc
+    ids, so the neighbours of a set of pages are a few array gathers.
+    """
+
+    def __init__(self, out_indptr, out_links, in_indptr, in_links):
+        self.out_indptr = out_indptr
+        self.out_links = out_links
+        self.in_indptr = in_indptr
+        self.in_links = in_links
+
+    @classmethod
+    def from_adjacency(cls, adjacency):
+        out_links = adjacency.tocsr()
+        in_links = adjacency.tocsc()
+        return cls(out_links.indptr.astype(np.int64), out_links.indices.astype(np.int64),
+                   in_links.indptr.astype(np.int64), in_links.indices.astype(np.int64))
+
+    @classmethod
+    def from_edges(cls, edges, num_nodes):
+        edges = np.asarray(edges)
+        return cls.from_adjacency(adjacency_from_edges(edges[:, 0], edges[:, 1], num_nodes))
+
+    def subgraph(self, root, max_in_links=QUERY_HITS_IN_LINKS, max_nodes=QUERY_HITS_MAX_NODES):
+        """
+        Kleinberg's base set: the root pages, every page they link to and up
+        to max_in_links pages linking to each, root pages first and at most
+        max_nodes in all. Returns (base doc ids, CSR adjacency among them).
+        """
+        root = np.asarray(root, dtype=np.int64)
+        _, linked = _gather(self.out_indptr, self.out_links, root)
+        _, linking = _gather(self.in_indptr, self.in_links, root, max_in_links)
+        extra = np.setdiff1d(np.concatenate([linked, linking]), root)
+        nodes = np.concatenate([root, extra[:max(0, max_nodes - root.size)]])
+
+        sources, targets = _gather(self.out_indptr, self.out_links, nodes)
+        order = np.argsort(nodes)
+        positions = np.searchsorted(nodes, targets, sorter=order)
+        positions[positions == nodes.size] = 0
+        inside = nodes[order[positions]] == targets
+        return nodes, adjacency_from_edges(sources[inside], order[positions[inside]], nodes.size)
+
+
+class ExternalLinks:
+    """
+    Links from indexed pages to urls that were not indexed, so a page added
+    later (see segments) gets the in-links a full rebuild would give it. The
+    targets of page i are ids into the interned `urls`, in
+    targets[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self, indptr, targets, urls):
+        self.indptr = indptr
+        self.targets = targets
+        # suggest.Strings of the distinct target urls
+        self.urls = urls
+
+    @classmethod
+    def from_pairs(cls, sources, targets, num_docs, url_names):
+        """
+        From (doc id, url id) pairs in any id space; url_names(ids) returns
+        the urls of a sorted array of url ids.
+        """
+        from suggest import Strings
+
+        pairs = np.unique(np.column_stack([sources, targets]).astype(np.int64), axis=0)
+        url_ids, compact = np.unique(pairs[:, 1], return_inverse=True)
+        indptr = np.zeros(num_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=num_docs), out=indptr[1:])
+        return cls(indptr, compact.astype(np.int64), Strings.encode(url_names(url_ids)))
+
+    def links(self, doc_id):
+        return [self.urls[i] for i in self.targets[self.indptr[doc_id]:self.indptr[doc_id + 1]].tolist()]
+
+
+def _gather(indptr, values, nodes, limit=None):
+    # (position in nodes, value) of every entry in the CSR rows of nodes,
+    # keeping the first `limit` of each row
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    if limit is not None:
+        lengths = np.minimum(lengths, limit)
+    owners = np.repeat(np.arange(nodes.size), lengths)
+    offsets = np.arange(owners.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, np.asarray(values[np.repeat(starts, lengths) + offsets], dtype=np.int64)
+
+
+def query_hits(links, root, max_iter=QUERY_HITS_MAX_ITER, tol=HITS_TOL):
+    """
+    HITS on the one-hop neighbourhood of the root pages (a query's top
+    candidates), run until it converges or for max_iter rounds. Returns
+    (hubs, authorities) of the root pages, each scaled so the best page of
+    the subgraph scores 1.
+    """
+    nodes, sub = links.subgraph(root)
+    if sub.nnz == 0:
+        return np.zeros(len(root)), np.zeros(len(root))
+    sub_t = sub.T.tocsr()
+
+    h = np.ones(nodes.size)
+    for _ in range(max_iter):
+        last = h
+        a = sub_t @ h
+        a /= a.max()
+        h = sub @ a
+        h /= h.max()
+        if np.abs(h - last).sum() < tol:
+            break
+    return h[:len(root)], a[:len(root)]
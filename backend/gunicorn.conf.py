@@ -0,0 +1,62 @@
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Pre-fork serving: `gunicorn app:app`, run from backend/, reads this file.
+# The app, and with it the memory-mapped index, is loaded once in the master
+# and the workers forked from it share those pages instead of loading their
+# own copies.
+bind = os.environ.get("SEARCH_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("SEARCH_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("SEARCH_THREADS", "8"))
+preload_app = True
+timeout = 60
+# Seconds old workers get to finish their requests after a SIGHUP; matches
+# search_engine.SHARD_DRAIN_SECONDS.
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Every worker writes its metrics to this directory and /metrics sums
+    # them, whichever worker answers the scrape (see metrics.share). Made
+    # once per master, so a SIGHUP's new workers keep adding to the totals.
+    server.metrics_dir = tempfile.mkdtemp(prefix="search-metrics-")
+
+
+def on_exit(server):
+    shutil.rmtree(server.metrics_dir, ignore_errors=True)
+
+
+def pre_fork(server, worker):
+    # Objects loaded so far (vocabularies, the indexer) are moved out of the
+    # cyclic GC's reach; its bookkeeping writes would otherwise copy their
+    # pages into every worker.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import metrics
+    import search_engine
+
+    # Workers serve the index they were forked with; see on_reload.
+    search_engine.RELOAD_ON_SWAP = False
+    metrics.share(server.metrics_dir)
+
+
+def worker_exit(server, worker):
+    import metrics
+
+    # Counts since the last snapshot, so the totals do not lose them
+    metrics.write_snapshot()
+
+
+def on_reload(server):
+    # `kill -HUP <master pid>` after an index swap: load the new index once
+    # here, then gunicorn forks fresh workers from it while the old ones
+    # finish their requests, so no request fails or waits for a load.
+    import search_engine
+
+    search_engine.refresh_index()
@@ -0,0 +1,423 @@
+import os
+import shutil
+import ujson as json
+from array import array
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from graph_rank import ExternalLinks, LinkIndex
+from inverted_index import InvertedIndex, PostingLists
+from lsa import LsaIndex
+from suggest import Strings, SuggestIndex
+from segments import SegmentedIndex, SEGMENTS_MANIFEST, segments_path
+
+# On-disk layout of a prebuilt index directory. Bump INDEX_VERSION whenever
+# the set of files or their meaning changes.
+INDEX_FORMAT = "sklearn-index"
+INDEX_VERSION = 5
+MANIFEST = "manifest.json"
+FIELDS = ("title", "body")
+GRAPH_SCORES = ("pagerank", "hubs", "authorities")
+# LinkIndex arrays, stored as graph_<name>.npy
+LINK_ARRAYS = ("out_indptr", "out_links", "in_indptr", "in_links")
+# Document record columns; every page's metadata has these keys.
+DOC_COLUMNS = ("url", "title", "description", "keywords")
+# Shard subdirectories of a sharded index
+SHARD_DIR = "shard-{:03d}"
+
+
+class DocStore:
+    """
+    Read-only per-document records stored column by column: each of
+    DOC_COLUMNS is one UTF-8 buffer with an offset array, so a lookup slices
+    out one document's strings and no Python object is kept per document.
+    """
+
+    def __init__(self, columns):
+        # column name -> (uint8 buffer, int64 offsets)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["url"][1]) - 1
+
+    def value(self, doc_id, column):
+        blob, offsets = self.columns[column]
+        return blob[offsets[doc_id]:offsets[doc_id + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, doc_id):
+        return self.value(doc_id, "url"), {
+            column: self.value(doc_id, column) for column in DOC_COLUMNS[1:]
+        }
+
+    def slice(self, start, stop):
+        """
+        The records of doc ids start..stop-1, renumbered from 0.
+        """
+        return DocStore({
+            column: (blob[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start])
+            for column, (blob, offsets) in self.columns.items()
+        })
+
+
+class DocStoreWriter:
+    """
+    Appends (url, metadata) pairs to growing column buffers; finish() wraps
+    them in a DocStore without copying.
+    """
+
+    def __init__(self):
+        self.buffers = {column: bytearray() for column in DOC_COLUMNS}
+        self.offsets = {column: array('q', [0]) for column in DOC_COLUMNS}
+
+    def add(self, url, metadata):
+        for column in DOC_COLUMNS:
+            value = url if column == "url" else metadata.get(column, "")
+            buffer = self.buffers[column]
+            buffer += value.encode("utf-8")
+            self.offsets[column].append(len(buffer))
+
+    def finish(self):
+        return DocStore({
+            column: (np.frombuffer(self.buffers[column], dtype=np.uint8),
+                     np.frombuffer(self.offsets[column], dtype=np.int64))
+            for column in DOC_COLUMNS
+        })
+
+    @classmethod
+    def encode(cls, documents):
+        writer = cls()
+        for url, metadata in documents:
+            writer.add(url, metadata)
+        return writer.finish()
+
+
+def _write_npy(dirpath, name, array):
+    np.save(os.path.join(dirpath, name + ".npy"), np.ascontiguousarray(array))
+
+
+def _read_npy(dirpath, name, mmap):
+    path = os.path.join(dirpath, name + ".npy")
+    if mmap and os.path.getsize(path) > 128:
+        return np.load(path, mmap_mode="r")
+    # Empty arrays cannot be memory-mapped
+    return np.load(path)
+
+
+def _replace_directory(dirpath, write):
+    # write(path) fills a directory next to the target, which is then renamed
+    # into place so readers never observe a half-written index.
+    tmp_path = dirpath.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    write(tmp_path)
+
+    old_path = dirpath.rstrip(os.sep) + ".old"
+    if os.path.exists(dirpath):
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.rename(dirpath, old_path)
+    os.rename(tmp_path, dirpath)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def _write_vectorizer(dirpath, field, vectorizer, shape):
+    _write_npy(dirpath, field + "_idf", vectorizer.idf_)
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, col in vectorizer.vocabulary_.items():
+        terms[col] = term
+    with open(os.path.join(dirpath, field + "_terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    return {
+        "shape": list(shape),
+        "stop_words": list(vectorizer.stop_words or []),
+    }
+
+
+def _read_vectorizer(dirpath, field, info):
+    with open(os.path.join(dirpath, field + "_terms.json"), "r", encoding="utf-8") as f:
+        terms = json.load(f)
+    vectorizer = TfidfVectorizer(
+        stop_words=info["stop_words"] or None,
+        vocabulary={term: col for col, term in enumerate(terms)},
+    )
+    vectorizer.idf_ = np.load(os.path.join(dirpath, field + "_idf.npy"))
+    return vectorizer
+
+
+def save_index(indexer, dirpath):
+    """
+    Write an indexer to `dirpath` as raw .npy arrays plus JSON vocabularies.
+    The directory is written next to the target and renamed into place, so
+    readers never observe a half-written index. A segmented indexer is
+    written as a rebuilt index of its live documents.
+    """
+    if indexer.segments is not None:
+        from build_pipeline import build_from_segments
+
+        indexer = build_from_segments(indexer)
+    _replace_directory(dirpath, lambda path: _write_index(indexer, path))
+
+
+def _write_index(indexer, dirpath):
+    manifest = {
+        "format": INDEX_FORMAT,
+        "version": INDEX_VERSION,
+        "num_docs": indexer.num_documents(),
+        "fields": {},
+    }
+
+    for field in FIELDS:
+        vectorizer = getattr(indexer, field + "_vectorizer")
+        matrix = sp.csr_matrix(getattr(indexer, field + "_tfidf_matrix"))
+        matrix.sort_indices()
+        _write_npy(dirpath, field + "_data", matrix.data)
+        # scipy needs indices and indptr in one dtype to wrap them without a copy
+        index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max else np.int64
+        _write_npy(dirpath, field + "_indices", matrix.indices.astype(index_dtype))
+        _write_npy(dirpath, field + "_indptr", matrix.indptr.astype(index_dtype))
+
+        postings = indexer.inverted_index.fields[field]
+        _write_npy(dirpath, field + "_postings_indptr", postings.indptr)
+        _write_npy(dirpath, field + "_postings_docs", postings.doc_ids)
+        _write_npy(dirpath, field + "_postings_weights", postings.weights)
+        _write_npy(dirpath, field + "_max_impact", postings.max_impact)
+
+        manifest["fields"][field] = _write_vectorizer(dirpath, field, vectorizer, matrix.shape)
+
+    for name, scores in zip(GRAPH_SCORES, indexer._graph_score_arrays()):
+        _write_npy(dirpath, name, scores)
+
+    _write_links(dirpath, indexer._link_index())
+    _write_npy(dirpath, "graph_edges", indexer.edges)
+    if indexer.external_links is not None:
+        manifest["external_links"] = _write_external_links(dirpath, indexer.external_links)
+
+    if indexer.lsa is not None:
+        manifest["lsa"] = _write_lsa(dirpath, indexer.lsa)
+    if indexer.suggestions is not None:
+        manifest["suggest"] = _write_suggest(dirpath, indexer.suggestions)
+
+    for column, (blob, offsets) in indexer.doc_store.columns.items():
+        _write_npy(dirpath, "docs_" + column, blob)
+        _write_npy(dirpath, "docs_" + column + "_offsets", offsets)
+
+    with open(os.path.join(dirpath, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _write_links(dirpath, links):
+    for name in LINK_ARRAYS:
+        _write_npy(dirpath, "graph_" + name, getattr(links, name))
+
+
+def _read_links(dirpath, mmap):
+    return LinkIndex(*(_read_npy(dirpath, "graph_" + name, mmap) for name in LINK_ARRAYS))
+
+
+def _write_external_links(dirpath, external):
+    _write_npy(dirpath, "graph_external_indptr", external.indptr)
+    _write_npy(dirpath, "graph_external_targets", external.targets)
+    _write_npy(dirpath, "graph_external_urls", external.urls.blob)
+    _write_npy(dirpath, "graph_external_urls_offsets", external.urls.offsets)
+    return {"urls": len(external.urls)}
+
+
+def _read_external_links(dirpath, mmap):
+    return ExternalLinks(_read_npy(dirpath, "graph_external_indptr", mmap),
+                         _read_npy(dirpath, "graph_external_targets", mmap),
+                         Strings(_read_npy(dirpath, "graph_external_urls", mmap),
+                                 _read_npy(dirpath, "graph_external_urls_offsets", mmap)))
+
+
+def _write_lsa(dirpath, lsa):
+    for field in FIELDS:
+        _write_npy(dirpath, "lsa_" + field + "_terms", lsa.term_vectors[field])
+    _write_npy(dirpath, "lsa_embeddings", lsa.embeddings)
+    if lsa.centroids is not None:
+        _write_npy(dirpath, "lsa_centroids", lsa.centroids)
+        _write_npy(dirpath, "lsa_list_indptr", lsa.list_indptr)
+        _write_npy(dirpath, "lsa_list_docs", lsa.list_docs)
+    return {"dimensions": lsa.term_vectors["title"].shape[1], "ivf": lsa.centroids is not None}
+
+
+def _read_lsa(dirpath, info, mmap):
+    term_vectors = {field: _read_npy(dirpath, "lsa_" + field + "_terms", mmap) for field in FIELDS}
+    ivf = [_read_npy(dirpath, name, mmap) for name in ("lsa_centroids", "lsa_list_indptr",
+                                                      "lsa_list_docs")] if info["ivf"] else []
+    return LsaIndex(term_vectors, _read_npy(dirpath, "lsa_embeddings", mmap), *ivf)
+
+
+def _write_suggest(dirpath, suggestions):
+    for name in ("keys", "texts", "heads"):
+        strings = getattr(suggestions, name)
+        _write_npy(dirpath, "suggest_" + name, strings.blob)
+        _write_npy(dirpath, "suggest_" + name + "_offsets", strings.offsets)
+    _write_npy(dirpath, "suggest_weights", suggestions.weights)
+    _write_npy(dirpath, "suggest_head_top", suggestions.head_top)
+    return {"completions": len(suggestions)}
+
+
+def _read_suggest(dirpath, mmap):
+    strings = [Strings(_read_npy(dirpath, "suggest_" + name, mmap),
+                       _read_npy(dirpath, "suggest_" + name + "_offsets", mmap))
+               for name in ("keys", "texts", "heads")]
+    return SuggestIndex(*strings[:2], _read_npy(dirpath, "suggest_weights", mmap),
+                        strings[2], _read_npy(dirpath, "suggest_head_top", mmap))
+
+
+def save_sharded_index(indexer, dirpath, num_shards):
+    """
+    Write a built indexer as `num_shards` index directories over contiguous
+    doc id ranges, plus the global vocabularies, IDF and link scores that the
+    coordinator (see shards.ShardedIndex) vectorizes and reranks with.
+
+    Every shard keeps the global term ids and IDF, and its posting lists keep
+    the global per-term maximum weights. Those are still valid MaxScore
+    bounds, and they make each shard add up a document's term weights in
+    the same order the whole index would, so scores match it bit for bit.
+    """
+    if indexer.segments is not None:
+        raise ValueError("Merge segmented updates with a full rebuild before sharding")
+    _replace_directory(dirpath, lambda path: _write_shards(indexer, path, num_shards))
+
+
+def _write_shards(indexer, dirpath, num_shards):
+    num_docs = indexer.num_documents()
+    manifest = {
+        "format": INDEX_FORMAT,
+        "version": INDEX_VERSION,
+        "num_docs": num_docs,
+        "fields": {},
+        "shards": [],
+    }
+    for field in FIELDS:
+        manifest["fields"][field] = _write_vectorizer(
+            dirpath, field, getattr(indexer, field + "_vectorizer"),
+            getattr(indexer, field + "_tfidf_matrix").shape)
+    for name, scores in zip(GRAPH_SCORES, indexer._graph_score_arrays()):
+        _write_npy(dirpath, name, scores)
+    _write_npy(dirpath, "graph_edges", indexer.edges)
+    _write_links(dirpath, indexer._link_index())
+    if indexer.suggestions is not None:
+        manifest["suggest"] = _write_suggest(dirpath, indexer.suggestions)
+
+    bounds = np.linspace(0, num_docs, num_shards + 1).astype(np.int64)
+    for shard, (start, stop) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist())):
+        name = SHARD_DIR.format(shard)
+        os.makedirs(os.path.join(dirpath, name))
+        _write_index(_shard_indexer(indexer, start, stop), os.path.join(dirpath, name))
+        manifest["shards"].append({"path": name, "offset": start, "num_docs": stop - start})
+
+    with open(os.path.join(dirpath, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _shard_indexer(indexer, start, stop):
+    from sklearn_indexer import SklearnIndexer
+
+    shard = SklearnIndexer()
+    postings = {}
+    for field in FIELDS:
+        matrix = getattr(indexer, field + "_tfidf_matrix")[start:stop]
+        setattr(shard, field + "_vectorizer", getattr(indexer, field + "_vectorizer"))
+        setattr(shard, field + "_tfidf_matrix", matrix)
+        postings[field] = PostingLists.from_matrix(matrix)
+        postings[field].max_impact = indexer.inverted_index.fields[field].max_impact
+    shard.inverted_index = InvertedIndex(postings)
+    shard.pr_scores, shard.hubs, shard.authorities = (
+        scores[start:stop] for scores in indexer._graph_score_arrays()
+    )
+    # The link graph stays with the coordinator
+    shard.edges = np.empty((0, 2), dtype=np.int64)
+    shard.doc_store = indexer.doc_store.slice(start, stop)
+    return shard
+
+
+def load_index(dirpath, mmap=True, shard_addresses=None):
+    """
+    Load an index directory written by save_index. With mmap=True the large
+    arrays are memory-mapped read-only, so startup does no copying and every
+    process serving the same directory shares one page-cache copy.
+
+    A directory written by save_sharded_index loads as a coordinator that
+    searches its shards through local shard processes, or through the shard
+    servers at `shard_addresses` ("host:port" per shard, in order).
+    """
+    from sklearn_indexer import SklearnIndexer
+
+    with open(os.path.join(dirpath, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != INDEX_FORMAT or manifest.get("version") != INDEX_VERSION:
+        raise ValueError(
+            f"Unsupported index at {dirpath}: format={manifest.get('format')} "
+            f"version={manifest.get('version')}, expected {INDEX_FORMAT} v{INDEX_VERSION}"
+        )
+
+    indexer = SklearnIndexer()
+    indexer.index_dir = dirpath
+    if "shards" in manifest:
+        from shards import ShardedIndex
+
+        for field in FIELDS:
+            setattr(indexer, field + "_vectorizer",
+                    _read_vectorizer(dirpath, field, manifest["fields"][field]))
+        indexer.edges = _read_npy(dirpath, "graph_edges", mmap)
+        indexer.link_index = _read_links(dirpath, mmap)
+        indexer.pr_scores, indexer.hubs, indexer.authorities = (
+            _read_npy(dirpath, name, mmap) for name in GRAPH_SCORES
+        )
+        if "suggest" in manifest:
+            indexer.suggestions = _read_suggest(dirpath, mmap)
+        indexer.shards = ShardedIndex(dirpath, manifest["shards"], shard_addresses)
+        return indexer
+
+    postings = {}
+    for field in FIELDS:
+        info = manifest["fields"][field]
+        matrix = sp.csr_matrix(
+            (
+                _read_npy(dirpath, field + "_data", mmap),
+                _read_npy(dirpath, field + "_indices", mmap),
+                _read_npy(dirpath, field + "_indptr", mmap),
+            ),
+            shape=tuple(info["shape"]),
+            copy=False,
+        )
+        setattr(indexer, field + "_vectorizer", _read_vectorizer(dirpath, field, info))
+        setattr(indexer, field + "_tfidf_matrix", matrix)
+        postings[field] = PostingLists(
+            _read_npy(dirpath, field + "_postings_indptr", mmap),
+            _read_npy(dirpath, field + "_postings_docs", mmap),
+            _read_npy(dirpath, field + "_postings_weights", mmap),
+            _read_npy(dirpath, field + "_max_impact", mmap),
+        )
+
+    indexer.inverted_index = InvertedIndex(postings)
+
+    indexer.edges = _read_npy(dirpath, "graph_edges", mmap)
+    indexer.link_index = _read_links(dirpath, mmap)
+    if "external_links" in manifest:
+        indexer.external_links = _read_external_links(dirpath, mmap)
+    indexer.pr_scores, indexer.hubs, indexer.authorities = (
+        _read_npy(dirpath, name, mmap) for name in GRAPH_SCORES
+    )
+    indexer.doc_store = DocStore({
+        column: (_read_npy(dirpath, "docs_" + column, mmap),
+                 _read_npy(dirpath, "docs_" + column + "_offsets", mmap))
+        for column in DOC_COLUMNS
+    })
+    if "suggest" in manifest:
+        indexer.suggestions = _read_suggest(dirpath, mmap)
+
+    # Documents added or deleted since the build
+    if os.path.exists(os.path.join(segments_path(dirpath), SEGMENTS_MANIFEST)):
+        indexer.segments = SegmentedIndex.load(segments_path(dirpath), {
+            "title": indexer.title_vectorizer.build_analyzer(),
+            "body": indexer.body_vectorizer.build_analyzer(),
+        })
+    elif "lsa" in manifest:
+        # The embeddings only cover the built documents
+        indexer.lsa = _read_lsa(dirpath, manifest["lsa"], mmap)
+    return indexer
@@ -0,0 +1,133 @@
+import numpy as np
+import scipy.sparse as sp
+
+FIELDS = ("title", "body")
+# Field weights of the fused score, applied as (2.0 * title)/3 + (1.0 * body)/3
+# exactly like the original dense cosine scoring did.
+FIELD_WEIGHTS = {"title": 2.0, "body": 1.0}
+FIELD_WEIGHT_TOTAL = 3
+# Upper bounds are summed in a different order than the real scores, so pad
+# them slightly to never prune a document over floating-point rounding.
+BOUND_SLACK = 1 + 1e-9
+
+
+def fuse_scores(title_scores, body_scores):
+    return (FIELD_WEIGHTS["title"] * title_scores)/FIELD_WEIGHT_TOTAL + \
+        (FIELD_WEIGHTS["body"] * body_scores)/FIELD_WEIGHT_TOTAL
+
+
+class PostingLists:
+    """
+    Per-term posting lists for one field: doc ids sorted ascending, the TF-IDF
+    weight of the term in each doc, and the largest weight in each list (in
+    a shard, the largest across all shards).
+    """
+
+    def __init__(self, indptr, doc_ids, weights, max_impact):
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.max_impact = max_impact
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        # CSC of the doc-term matrix is exactly a set of doc-sorted posting lists
+        csc = sp.csc_matrix(matrix)
+        csc.sort_indices()
+        lengths = np.diff(csc.indptr)
+        max_impact = np.zeros(csc.shape[1], dtype=csc.data.dtype)
+        nonempty = lengths > 0
+        if csc.nnz:
+            max_impact[nonempty] = np.maximum.reduceat(csc.data, csc.indptr[:-1][nonempty])
+        return cls(csc.indptr, csc.indices, csc.data, max_impact)
+
+    def postings(self, term_id):
+        lo, hi = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[lo:hi], self.weights[lo:hi]
+
+
+class InvertedIndex:
+    """
+    Title and body posting lists with MaxScore-style top-k retrieval over the
+    fused cosine score. Document and query vectors are L2-normalized by the
+    TF-IDF vectorizers, so the cosine is just the sum of weight products.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    @classmethod
+    def from_matrices(cls, title_matrix, body_matrix):
+        return cls({
+            "title": PostingLists.from_matrix(title_matrix),
+            "body": PostingLists.from_matrix(body_matrix),
+        })
+
+    def top_k(self, query_vectors, k):
+        """
+        Return (doc_ids, scores, boundary) for the k best documents ordered by
+        score descending then doc id. query_vectors maps field name to a 1-row
+        sparse query vector. boundary is an upper bound on the score of every
+        document left out, or -inf when nothing with a positive score was.
+        """
+        lists = []
+        for field_idx, field in enumerate(FIELDS):
+            postings = self.fields[field]
+            query = sp.csr_matrix(query_vectors[field])
+            for term_id, query_weight in zip(query.indices, query.data):
+                if postings.indptr[term_id] == postings.indptr[term_id + 1]:
+                    continue
+                upper_bound = (FIELD_WEIGHTS[field] * query_weight * postings.max_impact[term_id]) \
+                    / FIELD_WEIGHT_TOTAL
+                lists.append((upper_bound, field_idx, term_id, query_weight))
+
+        empty = np.empty(0, dtype=np.int64)
+        if not lists or k <= 0:
+            return empty, np.empty(0), -np.inf
+
+        # Highest-impact lists first; remaining[i] bounds what lists i.. can add.
+        lists.sort(key=lambda entry: entry[0], reverse=True)
+        remaining = (BOUND_SLACK * np.cumsum([entry[0] for entry in lists][::-1]))[::-1].tolist() + [0.0]
+
+        candidates = empty
+        partial = np.zeros((2, 0))
+        threshold = 0.0
+        complete = True
+        i = 0
+
+        # Essential lists: any document in them may still reach the top k, so
+        # their postings are merged into the candidate set.
+        while i < len(lists) and remaining[i] >= threshold:
+            _, field_idx, term_id, query_weight = lists[i]
+            doc_ids, weights = self.fields[FIELDS[field_idx]].postings(term_id)
+            merged = np.union1d(candidates, doc_ids)
+            grown = np.zeros((2, merged.size))
+            grown[:, np.searchsorted(merged, candidates)] = partial
+            grown[field_idx, np.searchsorted(merged, doc_ids)] += weights * query_weight
+            candidates, partial = merged, grown
+            i += 1
+            if candidates.size > k:
+                fused = fuse_scores(partial[0], partial[1])
+                threshold = np.partition(fused, candidates.size - k)[candidates.size - k]
+
+        # Non-essential lists: documents seen only here cannot reach the
+        # threshold, so they are only probed for the surviving candidates.
+        while i < len(lists):
+            complete = False
+            fused = fuse_scores(partial[0], partial[1])
+            alive = fused + remaining[i] >= threshold
+            candidates, partial = candidates[alive], partial[:, alive]
+            _, field_idx, term_id, query_weight = lists[i]
+            doc_ids, weights = self.fields[FIELDS[field_idx]].postings(term_id)
+            pos = np.searchsorted(doc_ids, candidates)
+            pos[pos == doc_ids.size] = 0
+            hit = doc_ids[pos] == candidates
+            partial[field_idx, hit] += weights[pos[hit]] * query_weight
+            i += 1
+
+        scores = fuse_scores(partial[0], partial[1])
+        order = np.lexsort((candidates, -scores))
+        if complete and order.size <= k:
+            return candidates[order], scores[order], -np.inf
+        order = order[:k]
+        return candidates[order], scores[order], scores[order[-1]]
@@ -0,0 +1,108 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from inverted_index import FIELDS, FIELD_WEIGHTS, FIELD_WEIGHT_TOTAL
+
+# Latent dimensions per field; a document embedding holds both fields.
+LSA_DIMENSIONS = 64
+# Indexes of at least IVF_MIN_DOCS documents are split into about
+# sqrt(num_docs) k-means lists, and a query scores only the LSA_PROBES lists
+# whose centroids match it best. Smaller ones are always scanned in full.
+IVF_MIN_DOCS = 20000
+LSA_PROBES = 8
+# Documents sampled to train the k-means centroids.
+KMEANS_SAMPLE = 100000
+RANDOM_STATE = 0
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class LsaIndex:
+    """
+    Dense retrieval over LSA (truncated SVD) projections of the title and
+    body TF-IDF matrices. A document embedding is its unit-length title and
+    body projections side by side, and a query embedding its own scaled by
+    the field weights, so one inner product gives the fused score of the two
+    latent-space cosines. Terms that co-occur, like "marxism" and
+    "communism", land close together, so documents match related terms too.
+
+    With IVF lists, a query only scores the documents of the `probes` lists
+    nearest to it; raising probes trades latency for recall, and probes >=
+    the number of lists is an exact scan.
+    """
+
+    def __init__(self, term_vectors, embeddings, centroids=None, list_indptr=None, list_docs=None):
+        # field -> (num_terms x dimensions) float32 latent vector of each term
+        self.term_vectors = term_vectors
+        # (num_docs x 2 * dimensions) float32
+        self.embeddings = embeddings
+        # IVF lists: centroids, and doc ids sorted by list with list offsets
+        self.centroids = centroids
+        self.list_indptr = list_indptr
+        self.list_docs = list_docs
+        self.probes = LSA_PROBES
+
+    @classmethod
+    def fit(cls, matrices, dimensions=LSA_DIMENSIONS):
+        """
+        Fit on the L2-normalized TF-IDF matrix of each field.
+        """
+        term_vectors, parts = {}, []
+        for field in FIELDS:
+            matrix = matrices[field]
+            svd = TruncatedSVD(max(1, min(dimensions, min(matrix.shape) - 1)),
+                               random_state=RANDOM_STATE)
+            parts.append(_unit_rows(svd.fit_transform(matrix)).astype(np.float32))
+            term_vectors[field] = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        embeddings = np.hstack(parts)
+
+        num_docs = embeddings.shape[0]
+        if num_docs < IVF_MIN_DOCS:
+            return cls(term_vectors, embeddings)
+        rng = np.random.RandomState(RANDOM_STATE)
+        sample = embeddings if num_docs <= KMEANS_SAMPLE else \
+            embeddings[rng.choice(num_docs, KMEANS_SAMPLE, replace=False)]
+        num_lists = int(np.sqrt(num_docs))
+        kmeans = MiniBatchKMeans(num_lists, random_state=RANDOM_STATE, n_init=3,
+                                 batch_size=4096).fit(sample)
+        labels = kmeans.predict(embeddings)
+        list_docs = np.argsort(labels, kind="stable").astype(np.int64)
+        list_indptr = np.searchsorted(labels[list_docs], np.arange(num_lists + 1)).astype(np.int64)
+        return cls(term_vectors, embeddings, kmeans.cluster_centers_.astype(np.float32),
+                   list_indptr, list_docs)
+
+    def embed(self, query_vectors):
+        parts = []
+        for field in FIELDS:
+            query = sp.csr_matrix(query_vectors[field])
+            vector = query.data.astype(np.float32) @ self.term_vectors[field][query.indices]
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector *= FIELD_WEIGHTS[field] / FIELD_WEIGHT_TOTAL / norm
+            parts.append(vector)
+        return np.concatenate(parts)
+
+    def score(self, query_vectors):
+        """
+        (doc ids ascending, scores) of the documents scored for a query,
+        keeping positive scores only.
+        """
+        query = self.embed(query_vectors)
+        if not query.any():
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if self.centroids is None or self.probes >= len(self.centroids):
+            scores = self.embeddings @ query
+            ids = np.flatnonzero(scores > 0)
+            return ids, scores[ids].astype(np.float64)
+
+        nearest = np.argpartition(-(self.centroids @ query), self.probes - 1)[:self.probes]
+        ids = np.sort(np.concatenate([self.list_docs[self.list_indptr[i]:self.list_indptr[i + 1]]
+                                      for i in nearest.tolist()]))
+        scores = self.embeddings[ids] @ query
+        positive = scores > 0
+        return ids[positive], scores[positive].astype(np.float64)
@@ -0,0 +1,255 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+import ujson as json
+
+# Latency buckets in seconds, from sub-millisecond index stages up to the
+# external backends' deadlines.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds between the snapshots a shared process writes (see share)
+SHARE_INTERVAL = 5
+
+_registry = []
+# Directory and file of this process's snapshots once share() is called
+_shared_dir = None
+_shared_path = None
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+    # Whether the values of several processes add up (see share)
+    summable = True
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self, state=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(self._state() if state is None else state))
+        return lines
+
+    @staticmethod
+    def _merge(total, value):
+        return total + value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _state(self):
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self, state):
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}"
+                for key, value in sorted(state.items())]
+
+
+class Gauge(_Metric):
+    """
+    Value read at scrape time: `read` returns a number, or a dict of label
+    value -> number when the gauge has one label. Pass kind="counter" for
+    totals that something else already keeps, such as cache hit counts.
+    """
+
+    def __init__(self, name, help, read, labels=(), kind="gauge"):
+        super().__init__(name, help, labels)
+        self.read = read
+        self.kind = kind
+        # Totals add up across processes; a level such as the index size
+        # is the same in all of them and is read live.
+        self.summable = kind == "counter"
+
+    def _state(self):
+        value = self.read()
+        if not self.labels:
+            return {(): value}
+        return {(key,): v for key, v in value.items()}
+
+    def _samples(self, state):
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}"
+                for key, value in sorted(state.items())]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram. observe() is a bisect and three additions
+    under a lock, cheap enough to time every stage of every request.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _state(self):
+        with self._lock:
+            return {key: [list(counts), total, count]
+                    for key, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def _merge(total, value):
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1],
+                total[2] + value[2]]
+
+    def _samples(self, state):
+        lines = []
+        for key, (counts, total, count) in sorted(state.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labels, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """
+    Every registered metric in the Prometheus text exposition format. Once
+    share() was called, summable metrics are the totals of every process
+    sharing the directory.
+    """
+    shared = _read_shared() if _shared_dir is not None else {}
+    lines = []
+    for metric in _registry:
+        if metric.summable and _shared_dir is not None:
+            lines.extend(metric.render(shared.get(metric.name, {})))
+        else:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def share(directory):
+    """
+    Under a pre-fork server each worker counts on its own, and a scrape
+    lands on any one of them. Called in every worker, this makes each write
+    its counters and histograms to its own file in `directory` every
+    SHARE_INTERVAL seconds and at every scrape it answers, and render() sum
+    all the files. Files of exited workers stay, so totals never go back.
+    """
+    global _shared_dir, _shared_path
+    os.makedirs(directory, exist_ok=True)
+    _shared_dir = directory
+    # pids are reused once workers are replaced; the time keeps names unique
+    _shared_path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+    write_snapshot()
+
+    def run():
+        while True:
+            time.sleep(SHARE_INTERVAL)
+            write_snapshot()
+
+    threading.Thread(target=run, name="metrics-share", daemon=True).start()
+
+
+def write_snapshot():
+    """
+    Write this process's summable metrics to its file in the shared
+    directory; a no-op unless share() was called.
+    """
+    if _shared_path is None:
+        return
+    snapshot = {metric.name: [[list(key), value] for key, value in metric._state().items()]
+                for metric in _registry if metric.summable}
+    temporary = _shared_path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, _shared_path)
+
+
+def _read_shared():
+    # metric name -> {label values: value summed over every process's file}
+    write_snapshot()
+    metrics = {metric.name: metric for metric in _registry if metric.summable}
+    totals = {}
+    for name in os.listdir(_shared_dir):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(_shared_dir, name), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, entries in snapshot.items():
+            metric = metrics.get(metric_name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(metric_name, {})
+            for key, value in entries:
+                key = tuple(key)
+                merged[key] = metric._merge(merged[key], value) if key in merged else value
+    return totals
+
+
+# Shared by the indexer, the search fan-out and the Flask app
+SEARCH_STAGE_SECONDS = Histogram(
+    "search_stage_seconds", "Time spent in each stage of a custom-engine query.", ["stage"])
+BACKEND_SECONDS = Histogram(
+    "search_backend_seconds", "Time for each search backend to answer, cache hits included.",
+    ["backend"])
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Flask request handling time by route.", ["route"])
+BACKEND_ERRORS = Counter(
+    "search_backend_errors_total", "Backends that timed out or failed in search_all.",
+    ["backend", "reason"])
+REQUEST_ERRORS = Counter(
+    "http_request_errors_total", "Requests that raised an unhandled exception, by route.",
+    ["route"])
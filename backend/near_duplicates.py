@@ -0,0 +1,111 @@
+import hashlib
+import re
+import numpy as np
+
+# Two pages are near-duplicates when the words and word pairs of their
+# title + description overlap by at least TEXT_SIMILARITY (Jaccard, estimated
+# from MinHash signatures) and their title words by at least TITLE_SIMILARITY.
+# The title check keeps pages that only share a site-wide description apart.
+TEXT_SIMILARITY = 0.8
+TITLE_SIMILARITY = 0.5
+SIGNATURE_SIZE = 32
+# LSH bands over the signature: pages at TEXT_SIMILARITY share a band with
+# probability 1 - (1 - 0.8**4)**8, about 98.5%.
+BANDS = 8
+ROWS = SIGNATURE_SIZE // BANDS
+
+_TOKEN = re.compile(r"\w+")
+# Fixed multiply-shift hash family (odd 64-bit multipliers, top 32 bits of
+# the product), so signatures stay comparable across runs and processes.
+_rng = np.random.RandomState(20240601)
+_MULTIPLIERS = _rng.randint(0, 2**62, size=SIGNATURE_SIZE, dtype=np.int64).astype(np.uint64) \
+    * np.uint64(2) + np.uint64(1)
+_OFFSETS = _rng.randint(0, 2**62, size=SIGNATURE_SIZE, dtype=np.int64).astype(np.uint64)
+
+
+def _hashes(features):
+    return np.frombuffer(b''.join(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest() for feature in features
+    ), dtype=np.uint64)
+
+
+def fingerprint(metadata):
+    """
+    (MinHash signature, sorted title word hashes) of a page's metadata, or
+    None when it has no words at all.
+    """
+    title_words = _TOKEN.findall(metadata.get("title", "").lower())
+    words = title_words + _TOKEN.findall(metadata.get("description", "").lower())
+    if not words:
+        return None
+    shingles = set(words)
+    shingles.update(a + ' ' + b for a, b in zip(words, words[1:]))
+    permuted = (_MULTIPLIERS[:, None] * _hashes(shingles)[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+    signature = permuted.min(axis=1).astype(np.uint32)
+    title = np.unique((_hashes(title_words) >> np.uint64(32)).astype(np.uint32))
+    return signature, title
+
+
+def _jaccard(a, b):
+    if not a.size and not b.size:
+        return 1.0
+    shared = np.intersect1d(a, b, assume_unique=True).size
+    return shared / (a.size + b.size - shared)
+
+
+class NearDuplicateIndex:
+    """
+    Banded LSH over MinHash signatures: each page is filed under its BANDS
+    band keys, so a lookup only verifies the pages sharing a band with it
+    instead of comparing against every page seen.
+    """
+
+    def __init__(self):
+        self.bands = [{} for _ in range(BANDS)]
+        self.signatures = np.empty((1024, SIGNATURE_SIZE), dtype=np.uint32)
+        self.titles = []
+        self.values = []
+
+    def _keys(self, signature):
+        return [signature[band * ROWS:(band + 1) * ROWS].tobytes() for band in range(BANDS)]
+
+    def find(self, fp):
+        """
+        Return the value stored with the earliest near-duplicate of
+        fingerprint fp, or None.
+        """
+        if fp is None:
+            return None
+        signature, title = fp
+        candidates = [entry for table, key in zip(self.bands, self._keys(signature))
+                      for entry in table.get(key, ())]
+        if not candidates:
+            return None
+        candidates = np.unique(candidates)
+        agreement = (self.signatures[candidates] == signature).mean(axis=1)
+        for entry in candidates[agreement >= TEXT_SIMILARITY]:
+            if _jaccard(title, self.titles[entry]) >= TITLE_SIMILARITY:
+                return self.values[entry]
+        return None
+
+    def add(self, fp, value):
+        if fp is None:
+            return
+        entry = len(self.values)
+        if entry == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        self.signatures[entry] = fp[0]
+        self.titles.append(fp[1])
+        self.values.append(value)
+        for table, key in zip(self.bands, self._keys(fp[0])):
+            table.setdefault(key, []).append(entry)
+
+    def check_add(self, fp, value):
+        """
+        Return the value of an earlier near-duplicate of fp, or record fp
+        with `value` and return None.
+        """
+        found = self.find(fp)
+        if found is None:
+            self.add(fp, value)
+        return found
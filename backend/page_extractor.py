@@ -0,0 +1,149 @@
+import urllib.parse
+from urllib.parse import urlparse
+from lxml import etree
+from lxml import html as lxml_html
+
+# Runs in the crawler's parse worker processes: everything here works on one
+# lxml tree per page and must stay picklable at module level.
+
+_MW_PARSER_OUTPUT = "//div[contains(concat(' ', normalize-space(@class), ' '), ' mw-parser-output ')]"
+
+
+def _first(doc, path):
+    found = doc.xpath(path)
+    return found[0] if found else None
+
+
+def _content(meta):
+    return meta.get("content", "").strip() if meta is not None else ""
+
+
+def _text(element):
+    return element.text_content().strip()
+
+
+def is_english(doc):
+    """
+    Return False if the page explicitly declares a non-English language
+    via <html lang="..."> or meta http-equiv/content-language or meta[name=language].
+    Otherwise True.
+    """
+    # 1) <html lang="...">
+    lang = doc.get("lang")
+    if lang is not None and not lang.strip().lower().startswith("en"):
+        return False
+    # 2) <meta http-equiv="content-language" content="...">
+    meta_http = _first(doc, "//meta[@http-equiv='content-language']")
+    if meta_http is not None and meta_http.get("content"):
+        lang = meta_http.get("content").split(",")[0].strip().lower()
+        if not lang.startswith("en"):
+            return False
+    # 3) <meta name="language" content="...">
+    meta_name = _first(doc, "//meta[@name='language']")
+    if meta_name is not None and meta_name.get("content"):
+        lang = meta_name.get("content").strip().lower()
+        if not lang.startswith("en"):
+            return False
+    return True
+
+
+def extract_links(doc, base_url):
+    """
+    Normalize and filter outgoing HTTP(S) links.
+    """
+    links = []
+    for href in doc.xpath("//a[@href]/@href"):
+        if href.startswith(("javascript:", "mailto:", "tel:", "#")):
+            continue
+        absu = urllib.parse.urljoin(str(base_url), href)
+        absu = urllib.parse.urldefrag(absu)[0]
+        p = urlparse(absu)
+        if p.scheme not in ("http", "https"):
+            continue
+        norm = urllib.parse.urlunparse((
+            p.scheme, p.netloc.lower(), p.path.rstrip("/"),
+            "", p.query, ""
+        ))
+        links.append(norm)
+    # dedupe preserving order
+    seen = set()
+    unique = []
+    for u in links:
+        if u not in seen:
+            seen.add(u)
+            unique.append(u)
+    return unique
+
+
+def _description(doc, base_url):
+    # 1) <meta name="description">, 2) Open Graph, 3) Twitter
+    for path in ("//meta[@name='description']",
+                 "//meta[@property='og:description']",
+                 "//meta[@name='twitter:description']"):
+        desc = _content(_first(doc, path))
+        if len(desc) >= 30 and " " in desc:
+            return desc
+
+    # 4) Wikipedia-specific fallback
+    if "wikipedia.org" in base_url:
+        container = _first(doc, _MW_PARSER_OUTPUT)
+        if container is not None:
+            for p in container.xpath(".//p"):
+                text = _text(p)
+                if len(text) >= 80 and not text.startswith(("Coordinates", "This is", "[")):
+                    return text
+
+    # 5) Generic <p> scan ≥80 chars, 6) Final fallback: the first <p>
+    paragraphs = doc.xpath("//p")
+    for p in paragraphs:
+        text = _text(p)
+        if len(text) >= 80:
+            return text
+    return _text(paragraphs[0]) if paragraphs else ""
+
+
+def _keywords(doc, base_url):
+    kw = _first(doc, "//meta[@name='keywords']")
+    if _content(kw):
+        return _content(kw)
+    # The first of these that exists wins, even with empty content
+    for path in ("//meta[@name='news_keywords']",
+                 "//meta[@property='og:keywords']",
+                 "//meta[@name='twitter:keywords']"):
+        meta = _first(doc, path)
+        if meta is not None:
+            return _content(meta)
+    if "wikipedia.org" in base_url:
+        # Wikipedia categories
+        cat_div = _first(doc, "//div[@id='mw-normal-catlinks']")
+        if cat_div is not None:
+            return ", ".join(_text(a) for a in cat_div.xpath(".//a")[1:])
+    return ""
+
+
+def extract_metadata(doc, base_url):
+    """
+    Extract title, description, and keywords with robust fallbacks.
+    """
+    title_el = _first(doc, "//title")
+    title = title_el.text.strip() if title_el is not None and title_el.text else ""
+    description = _description(doc, base_url)
+    keywords = _keywords(doc, base_url)
+    if not keywords and title:
+        keywords = title
+    return {"title": title, "description": description, "keywords": keywords}
+
+
+def extract_page(html_text, base_url):
+    """
+    Parse a fetched page once and return (is_english, metadata, links), or
+    None if it cannot be parsed. Metadata and links are None for pages
+    declared non-English.
+    """
+    try:
+        doc = lxml_html.document_fromstring(html_text)
+    except (etree.ParserError, ValueError):
+        return None
+    if not is_english(doc):
+        return False, None, None
+    return True, extract_metadata(doc, base_url), extract_links(doc, base_url)
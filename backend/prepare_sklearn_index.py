@@ -1,21 +1,45 @@
-import pickle
+import argparse
 from sklearn_indexer import SklearnIndexer
+from build_pipeline import build_index_parallel, iter_pages
+from crawl_store import CRAWL_DIR
+from index_store import save_index, save_sharded_index
+from lsa import LSA_DIMENSIONS
 import time
 
-print("🔁 Loading scraped_data_7.pkl...")
-with open("scraped_data.pkl", "rb") as f:
-    scraped_data = pickle.load(f)
+INDEX_DIR = "sklearn_index"
 
-print("🔧 Building Sklearn Indexer...")
+parser = argparse.ArgumentParser(description="Build the search index from crawl output.")
+parser.add_argument("source", nargs="?", default=CRAWL_DIR,
+                    help="crawl output: the crawler's shard directory, a .jsonl(.gz) file of "
+                         "pages, or a scraped_data .pkl/.json")
+parser.add_argument("--workers", type=int, default=None,
+                    help="tokenizer processes (default: one per core)")
+parser.add_argument("--keep-near-duplicates", action="store_true",
+                    help="index near-duplicate pages instead of collapsing them into the first copy")
+parser.add_argument("--shards", type=int, default=1,
+                    help="split the index into this many shards searched in parallel")
+parser.add_argument("--lsa", type=int, nargs="?", const=LSA_DIMENSIONS, default=None,
+                    metavar="DIMENSIONS",
+                    help="also fit LSA embeddings for the 'lsa' ranking algorithm "
+                         f"(default {LSA_DIMENSIONS} dimensions per field)")
+args = parser.parse_args()
+if args.lsa and args.shards > 1:
+    parser.error("--lsa is not supported for sharded indexes")
+
+print(f"🔧 Building Sklearn Indexer from {args.source}...")
 indexer = SklearnIndexer()
 start_time = time.time()
-indexer.build_index(scraped_data)
+build_index_parallel(indexer, iter_pages(args.source), workers=args.workers,
+                     collapse_near_duplicates=not args.keep_near_duplicates,
+                     lsa_dimensions=args.lsa, graph_dir=args.source)
 end_time = time.time()
 
 print(f"✅ Index built in {end_time - start_time:.2f}s.")
 
-# Save to .pkl
-with open("sklearn_index.pkl", "wb") as f:
-    pickle.dump(indexer, f)
-
-print("✅ Saved index as sklearn_index.pkl")
+# Save as a memory-mappable index directory
+if args.shards > 1:
+    save_sharded_index(indexer, INDEX_DIR, args.shards)
+    print(f"✅ Saved index to {INDEX_DIR}/ as {args.shards} shards")
+else:
+    save_index(indexer, INDEX_DIR)
+    print(f"✅ Saved index to {INDEX_DIR}/")
@@ -0,0 +1,111 @@
+import shelve
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """
+    Collapse case and whitespace so trivially different spellings of the same
+    query share a cache entry. The TF-IDF vectorizers lowercase and tokenize
+    anyway, so this never changes the results.
+    """
+    return ' '.join(query.lower().split())
+
+
+class ResultCache:
+    """
+    Bounded, thread-safe LRU cache of search results with a per-entry TTL.
+
+    Entries are tagged with the index version they were computed against;
+    calling set_version with a new version drops everything. An optional
+    shelve file acts as a second tier that survives restarts.
+    """
+
+    def __init__(self, max_entries=1024, ttl=600, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = shelve.open(disk_path) if disk_path else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def _disk_key(self, key):
+        return repr(key)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            if self._disk is not None:
+                entry = self._disk.get(self._disk_key(key))
+                if entry is not None:
+                    version, expires, value = entry
+                    if version == self.version and expires > now:
+                        self._store(key, expires, value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    del self._disk[self._disk_key(key)]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires, value)
+            if self._disk is not None:
+                self._disk[self._disk_key(key)] = (self.version, expires, value)
+
+    def _store(self, key, expires, value):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def set_version(self, version):
+        """
+        Record the version of the index being served; a change invalidates
+        every cached entry, in memory and on disk.
+        """
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                self._entries.clear()
+                if self._disk is not None:
+                    self._disk.clear()
+            self.version = version
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+            }
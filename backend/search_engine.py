@@ -1,23 +1,270 @@
-import pickle
-from sklearn_indexer import SklearnIndexer
+import base64
+import os
+import threading
+import time
+import zlib
+import ujson as json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from index_store import load_index, MANIFEST
+from metrics import BACKEND_SECONDS, BACKEND_ERRORS, Gauge
+from result_cache import ResultCache, normalize_query
+from segments import SEGMENTS_MANIFEST, segments_path
+from shards import parse_addresses
+from suggest import SUGGESTIONS
 from serpapi import GoogleSearch
 
-# Load prebuilt indexer
-print("🔁 Loading sklearn_index.pkl...")
-with open("sklearn_index.pkl", "rb") as f:
-    indexer = pickle.load(f)
+INDEX_DIR = "sklearn_index"
+
+# Result cache settings; set CACHE_DISK_PATH (e.g. "search_cache.db") to keep
+# cached results across restarts.
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL = 600
+CACHE_DISK_PATH = None
+
+# Shard servers of a sharded index ("host:port,host:port", in shard order).
+# Unset, each shard of a sharded index runs as a local process.
+SHARD_ADDRESSES = os.environ.get("SEARCH_SHARD_ADDRESSES")
+# Seconds a replaced sharded index keeps its shards up for requests in flight
+SHARD_DRAIN_SECONDS = 30
+# Reload on the first request after the index directory is swapped. The
+# pre-fork server (gunicorn.conf.py) turns this off in its workers and
+# reloads in the master on SIGHUP instead.
+RELOAD_ON_SWAP = True
+
+def index_version(path=INDEX_DIR):
+    # save_index renames a fresh directory into place, and segment updates
+    # rewrite the segments manifest, so inode and mtime change on either.
+    st = os.stat(os.path.join(path, MANIFEST))
+    version = [(st.st_ino, st.st_mtime_ns)]
+    try:
+        st = os.stat(os.path.join(segments_path(path), SEGMENTS_MANIFEST))
+        version.append((st.st_ino, st.st_mtime_ns))
+    except FileNotFoundError:
+        pass
+    return tuple(version)
+
+def _load():
+    return load_index(INDEX_DIR, shard_addresses=parse_addresses(SHARD_ADDRESSES)
+                      if SHARD_ADDRESSES else None)
+
+# Load prebuilt indexer (memory-mapped, shared across processes)
+print(f"🔁 Loading {INDEX_DIR}/...")
+indexer = _load()
+loaded_version = index_version()
 print("✅ SklearnIndexer loaded.")
 
+result_cache = ResultCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_DISK_PATH)
+result_cache.set_version(loaded_version)
+_reload_lock = threading.Lock()
+
+def refresh_index():
+    """
+    Reload the index if the directory on disk was swapped since it was
+    loaded, invalidating cached results. Returns the indexer to use.
+    """
+    global indexer, loaded_version
+    if not RELOAD_ON_SWAP:
+        return indexer
+    try:
+        version = index_version()
+    except OSError:
+        # Caught mid-swap; keep serving the current index
+        return indexer
+    if version != loaded_version:
+        with _reload_lock:
+            if version != loaded_version:
+                print(f"🔁 Index changed on disk, reloading {INDEX_DIR}/...")
+                previous, indexer = indexer, _load()
+                loaded_version = version
+                result_cache.set_version(version)
+                if previous.shards is not None:
+                    threading.Timer(SHARD_DRAIN_SECONDS, previous.shards.close).start()
+    return indexer
+
+def cache_stats():
+    return result_cache.stats()
+
 # === Custom Search Methods ===
 
+# Ranking algorithm -> SklearnIndexer.search flags; anything else is vector space
+SEARCH_FLAGS = {
+    'vector_space': dict(use_pagerank=False, use_hits=False, use_vector_space=True),
+    'pagerank': dict(use_pagerank=True, use_hits=False, use_vector_space=False),
+    'hits': dict(use_pagerank=False, use_hits=True, use_vector_space=False),
+    'lsa': dict(use_pagerank=False, use_hits=False, use_vector_space=False, use_lsa=True),
+    'query_hits': dict(use_pagerank=False, use_hits=False, use_vector_space=False,
+                       use_query_hits=True),
+}
+
+# Cursor pagination: a query's top PAGINATION_DEPTH results are ranked once
+# and cached as doc id and score arrays, and every page is a slice of them.
+PAGE_SIZE = 5
+PAGINATION_DEPTH = 50
+
+class InvalidCursor(ValueError):
+    pass
+
+class UnsupportedAlgorithm(ValueError):
+    pass
+
+def _ranked_search(current, query, algorithm, depth):
+    key = ("ranked", normalize_query(query), algorithm, depth)
+    return result_cache.get_or_compute(
+        key,
+        lambda: current.search(query, top_k=depth, ranked=True, **SEARCH_FLAGS[algorithm])
+    )
+
+def _cached_search(query, algorithm, top_k):
+    current = refresh_index()
+    ids, scores = _ranked_search(current, query, algorithm, max(top_k, PAGINATION_DEPTH))
+    return current.materialize(ids[:top_k], scores[:top_k])
+
+def _index_tag():
+    return zlib.crc32(repr(result_cache.version).encode())
+
+def _encode_cursor(query, algorithm, offset):
+    payload = json.dumps([_index_tag(), normalize_query(query), algorithm, offset])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor):
+    try:
+        tag, query, algorithm, offset = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor("Malformed cursor")
+    if algorithm not in SEARCH_FLAGS or not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor("Malformed cursor")
+    if tag != _index_tag():
+        raise InvalidCursor("The index changed since this cursor was issued; search again")
+    return query, algorithm, offset
+
+def _check_algorithm(current, algorithm):
+    if algorithm == 'lsa' and current.lsa is None:
+        raise UnsupportedAlgorithm("The 'lsa' ranking algorithm needs LSA embeddings, and this "
+                                   "index was built without them (prepare_sklearn_index.py --lsa)")
+
+def available_algorithms():
+    """
+    Ranking algorithms the current index supports, for clients to offer.
+    """
+    current = refresh_index()
+    return [algorithm for algorithm in SEARCH_FLAGS
+            if algorithm != 'lsa' or current.lsa is not None]
+
+def search_documents_page(query, algorithm, page_size=PAGE_SIZE, cursor=None):
+    """
+    One page of custom-engine results and the cursor of the next page (None
+    after the last one). A cursor continues the query it was issued for,
+    whatever `query` and `algorithm` say, until the index is swapped.
+    """
+    current = refresh_index()
+    if cursor is None:
+        algorithm = algorithm if algorithm in SEARCH_FLAGS else 'vector_space'
+        _check_algorithm(current, algorithm)
+        offset = 0
+    else:
+        query, algorithm, offset = _decode_cursor(cursor)
+    page_size = max(1, min(page_size, PAGINATION_DEPTH))
+    ids, scores = _ranked_search(current, query, algorithm, PAGINATION_DEPTH)
+    end = offset + page_size
+    return {
+        "results": current.materialize(ids[offset:end], scores[offset:end]),
+        "next_cursor": _encode_cursor(query, algorithm, end) if end < len(ids) else None,
+    }
+
 def search_documents_vector_space(query, top_k=5):
-    return indexer.search(query, use_pagerank=False, use_hits=False, use_vector_space=True)[:top_k]
+    return _cached_search(query, 'vector_space', top_k)
 
 def search_documents_pagerank(query, top_k=5):
-    return indexer.search(query, use_pagerank=True, use_hits=False,use_vector_space=False)[:top_k]
+    return _cached_search(query, 'pagerank', top_k)
 
 def search_documents_hits(query, top_k=5):
-    return indexer.search(query, use_pagerank=False, use_hits=True,use_vector_space=False)[:top_k]
+    return _cached_search(query, 'hits', top_k)
+
+def search_documents_lsa(query, top_k=5):
+    return _cached_search(query, 'lsa', top_k)
+
+def search_documents_query_hits(query, top_k=5):
+    return _cached_search(query, 'query_hits', top_k)
+
+def suggest(prefix, limit=SUGGESTIONS):
+    # Indexes saved before suggestions existed have none
+    suggestions = refresh_index().suggestions
+    return [] if suggestions is None else suggestions.suggest(prefix, limit)
+
+# Limits of one /api/search/batch request
+BATCH_MAX_QUERIES = 1000
+BATCH_MAX_TOP_K = 100
+
+def search_documents_batch(queries, algorithm='tfidf', top_k=5):
+    current = refresh_index()
+    _check_algorithm(current, algorithm)
+    return current.search_batch(queries, algorithm=algorithm, top_k=top_k)
+
+# ====== External backends ======
+
+# "serpapi" calls the real APIs; "stub" serves canned results locally so the
+# whole /api/search path can be load-tested offline.
+EXTERNAL_BACKEND = os.environ.get("SEARCH_EXTERNAL_BACKEND", "serpapi")
+STUB_LATENCY = float(os.environ.get("SEARCH_STUB_LATENCY", "0.05"))
+EXTERNAL_CACHE_TTL = 3600
+
+# Per-backend deadlines (seconds) for the concurrent fan-out in search_all
+BACKEND_DEADLINES = {"custom": 2.0, "google": 6.0, "bing": 6.0}
+
+external_cache = ResultCache(CACHE_MAX_ENTRIES, EXTERNAL_CACHE_TTL)
+_executor = ThreadPoolExecutor(max_workers=32)
+
+# Read at scrape time by /metrics
+_CACHES = {"results": result_cache, "external": external_cache}
+
+def _cache_stat(stat):
+    return lambda: {name: cache.stats()[stat] for name, cache in _CACHES.items()}
+
+Gauge("search_index_documents", "Documents in the index being served.",
+      lambda: indexer.num_documents())
+Gauge("search_cache_entries", "Entries held by each result cache.",
+      _cache_stat("entries"), ["cache"])
+for _stat in ("hits", "misses", "evictions"):
+    Gauge(f"search_cache_{_stat}_total", f"Result cache {_stat}.",
+          _cache_stat(_stat), ["cache"], kind="counter")
+
+def _serpapi_results(params):
+    search = GoogleSearch(params)
+    return search.get_dict()
+
+def _stub_results(params):
+    time.sleep(STUB_LATENCY)
+    count = params.get("num") or params.get("count") or 7
+    return {
+        "organic_results": [
+            {
+                "title": f"{params['engine'].title()} result {i + 1} for {params['q']}",
+                "link": f"https://{params['engine']}.example.com/search/{i + 1}",
+                "snippet": f"Canned {params['engine']} snippet {i + 1} for \"{params['q']}\"."
+            }
+            for i in range(count)
+        ]
+    }
+
+EXTERNAL_BACKENDS = {
+    "serpapi": _serpapi_results,
+    "stub": _stub_results,
+}
+
+def _external_search(params, num_results):
+    def fetch():
+        results = EXTERNAL_BACKENDS[EXTERNAL_BACKEND](params)
+        return [
+            {
+                "title": result.get("title", ""),
+                "url": result.get("link", ""),
+                "snippet": result.get("snippet", "")
+            }
+            for result in results.get("organic_results", [])
+        ]
+
+    key = (normalize_query(params["q"]), params["engine"], num_results)
+    return external_cache.get_or_compute(key, fetch)
 
 # ====== Real Google Search via SerpAPI ======
 
@@ -32,21 +279,11 @@ def search_google_serpapi(query, num_results=7):
         "hl": "en",                    # 🆕 Language set to English
         "no_cache": True               # 🆕 Always get fresh results
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
-
-    return [
-        {
-            "title": result.get("title", ""),
-            "url": result.get("link", ""),
-            "snippet": result.get("snippet", "")
-        }
-        for result in results.get("organic_results", [])
-    ]
+    return _external_search(params, num_results)
 
 # ====== Real Bing Search via SerpAPI ======
 
-def search_bing_serpapi(query, num_results=7):
+def search_bing_serpapi(query, num_results=7, fallback=True):
     params = {
         "engine": "bing",
         "q": query,
@@ -59,24 +296,55 @@ def search_bing_serpapi(query, num_results=7):
         # "hl": "en",
         # "no_cache": True
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
-    if [
-        {
-            "title": result.get("title", ""),
-            "url": result.get("link", ""),
-            "snippet": result.get("snippet", "")
-        }
-        for result in results.get("organic_results", [])
-    ]==[]:
+    results = _external_search(params, num_results)
+    if not results and fallback:
         return search_google_serpapi(query)
-    else:
+    return results
 
-        return [
-            {
-                "title": result.get("title", ""),
-                "url": result.get("link", ""),
-                "snippet": result.get("snippet", "")
-            }
-            for result in results.get("organic_results", [])
-        ]
+# ====== Concurrent fan-out ======
+
+def _timed(name, fn, *args, **kwargs):
+    with BACKEND_SECONDS.time(backend=name):
+        return fn(*args, **kwargs)
+
+def search_all(query, algorithm, page_size=PAGE_SIZE):
+    """
+    Query the custom engine, Google and Bing concurrently. Each backend gets
+    its own deadline from BACKEND_DEADLINES; one that times out or fails
+    contributes an empty list instead of holding up the response. The
+    custom results are the first page, with `next_cursor` for the next.
+    An algorithm the index does not support raises UnsupportedAlgorithm
+    before any backend is queried.
+    """
+    _check_algorithm(refresh_index(), algorithm)
+    start = time.monotonic()
+    futures = {
+        "custom": _executor.submit(_timed, "custom", search_documents_page, query, algorithm,
+                                   page_size),
+        "google": _executor.submit(_timed, "google", search_google_serpapi, query),
+        # Bing's Google fallback reuses the Google call already in flight
+        "bing": _executor.submit(_timed, "bing", search_bing_serpapi, query, fallback=False),
+    }
+
+    response = {"timed_out": [], "failed": [], "next_cursor": None}
+    for name, future in futures.items():
+        remaining = start + BACKEND_DEADLINES[name] - time.monotonic()
+        try:
+            response[name] = future.result(timeout=max(0.0, remaining))
+            if name == "custom":
+                response["next_cursor"] = response[name]["next_cursor"]
+                response[name] = response[name]["results"]
+        except FutureTimeout:
+            response[name] = []
+            response["timed_out"].append(name)
+            BACKEND_ERRORS.inc(backend=name, reason="timeout")
+        except Exception as e:
+            print(f"⚠️ {name} search failed: {e}")
+            response[name] = []
+            response["failed"].append(name)
+            BACKEND_ERRORS.inc(backend=name, reason="error")
+
+    bing_answered = "bing" not in response["timed_out"] and "bing" not in response["failed"]
+    if bing_answered and not response["bing"]:
+        response["bing"] = response["google"]
+    return response
@@ -0,0 +1,500 @@
+import os
+import shutil
+import threading
+import ujson as json
+from bisect import bisect_right
+from collections import Counter
+import numpy as np
+import scipy.sparse as sp
+from graph_rank import LinkIndex, adjacency_from_edges, pagerank, hits
+from inverted_index import FIELDS, fuse_scores
+
+# Segments live under <index dir>/segments/, next to the base index they extend.
+SEGMENTS_DIR = "segments"
+SEGMENTS_MANIFEST = "manifest.json"
+# Background merging compacts the smallest segments once there are more than this.
+MERGE_FACTOR = 8
+
+
+def segments_path(index_dir):
+    return os.path.join(index_dir, SEGMENTS_DIR)
+
+
+def _write_json(path, data):
+    # Write-then-rename so readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Segment:
+    """
+    An immutable batch of documents: raw term counts per field over the global
+    term dictionary, plus urls, metadata and outgoing links. Only the live
+    mask (deletions) and the cached graph scores change after it is written.
+    """
+
+    def __init__(self, name, urls, metadata, links, counts, live=None, graph=None):
+        self.name = name
+        self.urls = urls
+        self.metadata = metadata
+        self.links = links
+        # field -> CSR (docs x terms) of raw term counts
+        self.counts = counts
+        # field -> CSC of the same counts, i.e. doc-sorted posting lists
+        self.postings = {field: sp.csc_matrix(matrix) for field, matrix in counts.items()}
+        for matrix in self.postings.values():
+            matrix.sort_indices()
+        self.live = np.ones(len(urls), dtype=bool) if live is None else live
+        # rows: pagerank, hubs, authorities
+        self.graph = np.zeros((3, len(urls))) if graph is None else graph
+
+    def __len__(self):
+        return len(self.urls)
+
+    def num_live(self):
+        return int(self.live.sum())
+
+    def save(self, root):
+        path = os.path.join(root, self.name)
+        os.makedirs(path, exist_ok=True)
+        for field, matrix in self.counts.items():
+            sp.save_npz(os.path.join(path, field + "_counts.npz"), matrix)
+        _write_json(os.path.join(path, "docs.json"), {
+            "urls": self.urls,
+            "metadata": self.metadata,
+            "links": self.links,
+        })
+        self.save_state(root)
+
+    def save_state(self, root):
+        # The mutable part of a segment: deletions and graph scores
+        path = os.path.join(root, self.name)
+        np.save(os.path.join(path, "live.npy"), self.live)
+        np.save(os.path.join(path, "graph.npy"), self.graph)
+
+    @classmethod
+    def load(cls, root, name):
+        path = os.path.join(root, name)
+        docs = _read_json(os.path.join(path, "docs.json"))
+        counts = {field: sp.load_npz(os.path.join(path, field + "_counts.npz")).tocsr()
+                  for field in FIELDS}
+        return cls(
+            name, docs["urls"], docs["metadata"], docs["links"], counts,
+            live=np.load(os.path.join(path, "live.npy")),
+            graph=np.load(os.path.join(path, "graph.npy")),
+        )
+
+
+class SegmentedIndex:
+    """
+    A searchable set of segments sharing one append-only term dictionary per
+    field. Document frequencies are kept current on every add and delete, and
+    IDF, document norms and scores are derived from them the same way
+    TfidfVectorizer does, so rankings match a full rebuild of the live docs.
+    """
+
+    def __init__(self, analyzers, dirpath=None):
+        # field -> callable(text) -> tokens, taken from the fitted vectorizers
+        self.analyzers = analyzers
+        self.dirpath = dirpath
+        self.terms = {field: [] for field in FIELDS}
+        self.vocabulary = {field: {} for field in FIELDS}
+        self.df = {field: np.zeros(0, dtype=np.int64) for field in FIELDS}
+        self.segments = []
+        self.next_segment = 0
+        self.generation = 0
+        # live url -> (segment, local doc id)
+        self.locations = {}
+        # Held by callers that turn scored doc ids into documents, so a merge
+        # cannot renumber them in between
+        self.lock = threading.RLock()
+        self._derived = None
+        self._derived_generation = -1
+        self._links = None
+        self._links_generation = -1
+
+    # --- construction and persistence ---
+
+    @classmethod
+    def from_indexer(cls, indexer, dirpath=None):
+        """
+        Start a segmented index whose first segment holds every document of a
+        built or loaded SklearnIndexer, with its link graph and scores.
+        """
+        from sklearn_indexer import field_texts
+
+        index = cls({
+            "title": indexer.title_vectorizer.build_analyzer(),
+            "body": indexer.body_vectorizer.build_analyzer(),
+        }, dirpath)
+
+        urls, metadata, texts = [], [], {field: [] for field in FIELDS}
+        for url, meta in indexer.iter_documents():
+            urls.append(url)
+            metadata.append(meta)
+            for field, text in zip(FIELDS, field_texts(meta)):
+                texts[field].append(text)
+
+        links = [[] for _ in urls]
+        if indexer.edges is not None:
+            for from_id, to_id in np.asarray(indexer.edges).tolist():
+                links[from_id].append(urls[to_id])
+        # Links to urls that were not indexed, so pages added later get them
+        if indexer.external_links is not None:
+            for doc_id, out_urls in enumerate(links):
+                out_urls += indexer.external_links.links(doc_id)
+
+        graph = np.vstack(indexer._graph_score_arrays())
+        with index.lock:
+            index._append_segment(urls, metadata, links, texts, graph)
+            index._commit()
+        return index
+
+    @classmethod
+    def load(cls, dirpath, analyzers):
+        index = cls(analyzers, dirpath)
+        manifest = _read_json(os.path.join(dirpath, SEGMENTS_MANIFEST))
+        index.next_segment = manifest["next_segment"]
+        index.generation = manifest["generation"]
+        for field in FIELDS:
+            index.terms[field] = _read_json(os.path.join(dirpath, field + "_terms.json"))
+            index.vocabulary[field] = {term: i for i, term in enumerate(index.terms[field])}
+            index.df[field] = np.zeros(len(index.terms[field]), dtype=np.int64)
+        for name in manifest["segments"]:
+            segment = Segment.load(dirpath, name)
+            index.segments.append(segment)
+            index._count_df(segment, np.flatnonzero(segment.live), 1)
+            for local_id in np.flatnonzero(segment.live).tolist():
+                index.locations[segment.urls[local_id]] = (segment, local_id)
+        return index
+
+    def _commit(self):
+        # Persist terms and the segment list, then bump the generation that
+        # searches and readers of the manifest use to notice the change.
+        self.generation += 1
+        if self.dirpath is None:
+            return
+        os.makedirs(self.dirpath, exist_ok=True)
+        for field in FIELDS:
+            _write_json(os.path.join(self.dirpath, field + "_terms.json"), self.terms[field])
+        _write_json(os.path.join(self.dirpath, SEGMENTS_MANIFEST), {
+            "generation": self.generation,
+            "next_segment": self.next_segment,
+            "segments": [segment.name for segment in self.segments],
+        })
+
+    # --- updates ---
+
+    def _count_matrix(self, field, texts):
+        vocabulary = self.vocabulary[field]
+        terms = self.terms[field]
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            for term, count in Counter(self.analyzers[field](text)).items():
+                term_id = vocabulary.get(term)
+                if term_id is None:
+                    term_id = vocabulary[term] = len(terms)
+                    terms.append(term)
+                indices.append(term_id)
+                data.append(count)
+            indptr.append(len(indices))
+        matrix = sp.csr_matrix(
+            (np.asarray(data, dtype=np.int32), np.asarray(indices, dtype=np.int32), indptr),
+            shape=(len(texts), len(terms)),
+        )
+        matrix.sort_indices()
+        return matrix
+
+    def _count_df(self, segment, local_ids, sign):
+        for field in FIELDS:
+            rows = segment.counts[field][local_ids]
+            df = self.df[field]
+            if df.size < len(self.terms[field]):
+                df = self.df[field] = np.concatenate(
+                    [df, np.zeros(len(self.terms[field]) - df.size, dtype=np.int64)])
+            df[:rows.shape[1]] += sign * np.bincount(rows.indices, minlength=rows.shape[1])
+
+    def _append_segment(self, urls, metadata, links, texts, graph=None):
+        counts = {field: self._count_matrix(field, texts[field]) for field in FIELDS}
+        segment = Segment(f"seg_{self.next_segment:06d}", urls, metadata, links, counts, graph=graph)
+        self.next_segment += 1
+        self.segments.append(segment)
+        self._count_df(segment, np.arange(len(segment)), 1)
+        for local_id, url in enumerate(urls):
+            self.locations[url] = (segment, local_id)
+        if self.dirpath is not None:
+            segment.save(self.dirpath)
+        return segment
+
+    def _delete(self, url):
+        segment, local_id = self.locations.pop(url)
+        segment.live[local_id] = False
+        self._count_df(segment, np.array([local_id]), -1)
+        return segment
+
+    def add_documents(self, web_graph):
+        """
+        Add pages given in the crawler's web_graph shape
+        ({url: {"metadata": {...}, "links": [...]}}) as one new segment.
+        Pages whose url is already indexed replace the old version.
+        """
+        from sklearn_indexer import field_texts
+
+        with self.lock:
+            urls, metadata, links = [], [], []
+            texts = {field: [] for field in FIELDS}
+            touched = set()
+            for url, data in web_graph.items():
+                if url in self.locations:
+                    touched.add(self._delete(url))
+                meta = data.get("metadata", {})
+                urls.append(url)
+                metadata.append(meta)
+                links.append(list(data.get("links", [])))
+                for field, text in zip(FIELDS, field_texts(meta)):
+                    texts[field].append(text)
+            if not urls:
+                return
+            self._append_segment(urls, metadata, links, texts)
+            self._save_states(touched)
+            self._commit()
+
+    def delete_documents(self, urls):
+        with self.lock:
+            touched = {self._delete(url) for url in urls if url in self.locations}
+            if not touched:
+                return
+            self._save_states(touched)
+            self._commit()
+
+    def _save_states(self, segments):
+        if self.dirpath is not None:
+            for segment in segments:
+                segment.save_state(self.dirpath)
+
+    # --- link analysis ---
+
+    def refresh_graph(self):
+        """
+        Recompute PageRank and HITS over the live documents, starting the power
+        iterations from the previous scores so a small update converges in a
+        few rounds instead of from scratch.
+        """
+        with self.lock:
+            _, _, offsets, previous = self._derive()
+            adjacency = self._adjacency(offsets)
+            pr = pagerank(adjacency, start=previous[0])
+            hubs, authorities = hits(adjacency, start=previous[1])
+
+            scores = np.vstack([pr, hubs, authorities])
+            for segment, offset in zip(self.segments, offsets):
+                segment.graph = scores[:, offset:offset + len(segment)]
+            self._save_states(self.segments)
+            self._commit()
+
+    def _adjacency(self, offsets):
+        # Links between live documents, in the global id space
+        segment_offsets = {segment.name: offset for segment, offset in zip(self.segments, offsets)}
+        sources, targets = [], []
+        for segment, offset in zip(self.segments, offsets):
+            for local_id in np.flatnonzero(segment.live).tolist():
+                for out_url in segment.links[local_id]:
+                    location = self.locations.get(out_url)
+                    if location is not None:
+                        sources.append(offset + local_id)
+                        targets.append(segment_offsets[location[0].name] + location[1])
+        return adjacency_from_edges(np.asarray(sources, dtype=np.int64),
+                                    np.asarray(targets, dtype=np.int64), self.num_documents())
+
+    def compact(self):
+        """
+        The live documents renumbered from 0 in doc id order, for writing them
+        out as a built index: their urls, metadata and out-link urls, per
+        field the terms they contain with a CSR count matrix over those terms,
+        and the adjacency matrix of the links between them.
+        """
+        with self.lock:
+            _, _, offsets, _ = self._derive()
+            live = np.concatenate([segment.live for segment in self.segments]) \
+                if self.segments else np.zeros(0, dtype=bool)
+            urls, metadata, links = [], [], []
+            for segment in self.segments:
+                for local_id in np.flatnonzero(segment.live).tolist():
+                    urls.append(segment.urls[local_id])
+                    metadata.append(segment.metadata[local_id])
+                    links.append(segment.links[local_id])
+            counts = {}
+            for field in FIELDS:
+                num_terms = len(self.terms[field])
+                rows = []
+                for segment in self.segments:
+                    matrix = segment.counts[field][segment.live]
+                    matrix.resize((matrix.shape[0], num_terms))
+                    rows.append(matrix)
+                matrix = sp.vstack(rows, format="csr") if rows else sp.csr_matrix((0, num_terms))
+                # Terms only found in deleted docs are unknown to a full rebuild
+                used = np.flatnonzero(np.bincount(matrix.indices, minlength=num_terms))
+                counts[field] = ([self.terms[field][i] for i in used.tolist()], matrix[:, used])
+            adjacency = self._adjacency(offsets)[live][:, live]
+        return urls, metadata, links, counts, adjacency
+
+    def link_index(self):
+        """
+        LinkIndex of the live documents, rebuilt once per generation.
+        """
+        with self.lock:
+            if self._links_generation != self.generation:
+                self._links = LinkIndex.from_adjacency(self._adjacency(self._derive()[2]))
+                self._links_generation = self.generation
+            return self._links
+
+    # --- merging ---
+
+    def merge(self, merge_factor=MERGE_FACTOR):
+        """
+        Rewrite the merge_factor smallest segments as one, dropping deleted
+        documents. The new segment is built without holding the lock, and
+        deletions that land meanwhile are carried over before it is swapped in.
+        """
+        with self.lock:
+            if len(self.segments) <= merge_factor:
+                return False
+            sources = sorted(self.segments, key=Segment.num_live)[:merge_factor]
+            snapshots = [segment.live.copy() for segment in sources]
+            num_terms = {field: len(self.terms[field]) for field in FIELDS}
+
+        urls, metadata, links, graphs = [], [], [], []
+        counts = {field: [] for field in FIELDS}
+        for segment, live in zip(sources, snapshots):
+            keep = np.flatnonzero(live)
+            urls += [segment.urls[i] for i in keep.tolist()]
+            metadata += [segment.metadata[i] for i in keep.tolist()]
+            links += [segment.links[i] for i in keep.tolist()]
+            graphs.append(segment.graph[:, keep])
+            for field in FIELDS:
+                rows = segment.counts[field][keep]
+                rows.resize((rows.shape[0], num_terms[field]))
+                counts[field].append(rows)
+        counts = {field: sp.vstack(matrices, format="csr") for field, matrices in counts.items()}
+
+        with self.lock:
+            merged = Segment(f"seg_{self.next_segment:06d}", urls, metadata, links, counts,
+                             graph=np.hstack(graphs))
+            self.next_segment += 1
+            # Carry over deletions made while merging
+            positions = {url: i for i, url in enumerate(urls)}
+            for segment, live in zip(sources, snapshots):
+                for local_id in np.flatnonzero(live & ~segment.live).tolist():
+                    merged.live[positions[segment.urls[local_id]]] = False
+            if self.dirpath is not None:
+                merged.save(self.dirpath)
+
+            self.segments = [segment for segment in self.segments if segment not in sources]
+            self.segments.append(merged)
+            for local_id in np.flatnonzero(merged.live).tolist():
+                self.locations[merged.urls[local_id]] = (merged, local_id)
+            self._commit()
+
+            if self.dirpath is not None:
+                for segment in sources:
+                    shutil.rmtree(os.path.join(self.dirpath, segment.name), ignore_errors=True)
+        return True
+
+    # --- search ---
+
+    def num_documents(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def _derive(self):
+        # IDF, per-segment doc norms, global id offsets and graph arrays, all
+        # recomputed once per generation.
+        if self._derived_generation == self.generation:
+            return self._derived
+        num_live = len(self.locations)
+        idf = {}
+        for field in FIELDS:
+            df = self.df[field]
+            # Same smoothed IDF as TfidfVectorizer
+            idf[field] = np.log((1 + num_live) / (1 + df)) + 1
+        norms = []
+        for segment in self.segments:
+            segment_norms = {}
+            for field in FIELDS:
+                counts = segment.counts[field]
+                squared = counts.multiply(counts) @ (idf[field][:counts.shape[1]] ** 2)
+                segment_norms[field] = np.sqrt(squared)
+            norms.append(segment_norms)
+        offsets = np.cumsum([0] + [len(segment) for segment in self.segments]).tolist()
+        graph = np.hstack([segment.graph for segment in self.segments]) \
+            if self.segments else np.zeros((3, 0))
+        self._derived = (idf, norms, offsets, tuple(graph))
+        self._derived_generation = self.generation
+        return self._derived
+
+    def _query_vector(self, field, query, idf):
+        counts = Counter()
+        for term in self.analyzers[field](query):
+            term_id = self.vocabulary[field].get(term)
+            # Terms only found in deleted docs are unknown to a full rebuild
+            if term_id is not None and self.df[field][term_id] > 0:
+                counts[term_id] += 1
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        term_ids = np.fromiter(counts.keys(), dtype=np.int64)
+        weights = np.fromiter(counts.values(), dtype=float) * idf[field][term_ids]
+        return term_ids, weights / np.sqrt((weights ** 2).sum())
+
+    def score(self, query):
+        """
+        Return (doc_ids, fused cosine scores) for every live document sharing a
+        term with the query, doc_ids sorted ascending in the global id space.
+        """
+        with self.lock:
+            idf, norms, offsets, _ = self._derive()
+            ids, fields, contributions = [], [], []
+            for field_idx, field in enumerate(FIELDS):
+                term_ids, query_weights = self._query_vector(field, query, idf)
+                for segment, offset, segment_norms in zip(self.segments, offsets, norms):
+                    postings = segment.postings[field]
+                    for term_id, query_weight in zip(term_ids.tolist(), query_weights.tolist()):
+                        if term_id >= postings.shape[1]:
+                            continue
+                        lo, hi = postings.indptr[term_id], postings.indptr[term_id + 1]
+                        doc_ids = postings.indices[lo:hi]
+                        live = segment.live[doc_ids]
+                        doc_ids = doc_ids[live]
+                        weights = postings.data[lo:hi][live] * idf[field][term_id] \
+                            / segment_norms[field][doc_ids]
+                        ids.append(doc_ids + offset)
+                        fields.append(np.full(doc_ids.size, field_idx))
+                        contributions.append(query_weight * weights)
+
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ids = np.concatenate(ids)
+        fields = np.concatenate(fields)
+        contributions = np.concatenate(contributions)
+        doc_ids, inverse = np.unique(ids, return_inverse=True)
+        field_scores = [
+            np.bincount(inverse[fields == field_idx], contributions[fields == field_idx],
+                        minlength=doc_ids.size)
+            for field_idx in range(len(FIELDS))
+        ]
+        return doc_ids, fuse_scores(*field_scores)
+
+    def get_document(self, doc_id):
+        _, _, offsets, _ = self._derive()
+        position = bisect_right(offsets, doc_id) - 1
+        segment = self.segments[position]
+        local_id = doc_id - offsets[position]
+        return segment.urls[local_id], segment.metadata[local_id]
+
+    def graph_score_arrays(self):
+        return self._derive()[3]
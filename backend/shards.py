@@ -0,0 +1,239 @@
+import argparse
+import atexit
+import os
+import queue
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+# Shared secret of the coordinator and its shard servers. Local shard
+# processes get a random one; remote servers must be started with the same
+# value the coordinator has.
+AUTHKEY_ENV = "SEARCH_SHARD_AUTHKEY"
+# Seconds to wait for local shard processes to load and start listening.
+START_TIMEOUT = 120
+
+
+def parse_addresses(text):
+    """
+    "host:port,host:port" -> [(host, port), ...]
+    """
+    addresses = []
+    for item in text.split(","):
+        host, port = item.strip().rsplit(":", 1)
+        addresses.append((host, int(port)))
+    return addresses
+
+
+# --- shard server ---
+
+def serve_shard(dirpath, address, authkey):
+    """
+    Serve one shard directory: top-k retrieval over its posting lists and
+    document lookups, one thread per coordinator connection.
+    """
+    from index_store import load_index
+
+    shard = load_index(dirpath)
+    with Listener(address, authkey=authkey) as listener:
+        print(f"🧩 Serving {dirpath} ({len(shard.doc_store)} docs) on {listener.address}", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"⚠️ Rejected shard connection: {e}", flush=True)
+                continue
+            threading.Thread(target=_serve_connection, args=(shard, conn), daemon=True).start()
+
+
+def _serve_connection(shard, conn):
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _handle(shard, request))
+            except Exception as e:
+                reply = ("error", repr(e))
+            conn.send(reply)
+
+
+def _handle(shard, request):
+    op = request[0]
+    if op == "top_k":
+        _, query_vectors, k = request
+        ids, scores, boundary = shard.inverted_index.top_k(query_vectors, k)
+        return ids, scores, boundary, [shard.doc_store[doc_id] for doc_id in ids.tolist()]
+    if op == "documents":
+        return [shard.doc_store[doc_id] for doc_id in request[1]]
+    raise ValueError(f"unknown shard request {op!r}")
+
+
+# --- coordinator ---
+
+class ShardedIndex:
+    """
+    Scatter-gather over the shards of an index written by
+    save_sharded_index. Shards cover contiguous doc id ranges, so a global
+    doc id is a shard's offset plus its local id and ties still break by
+    doc id.
+
+    top_k sends the query vectors to every shard in parallel and merges the
+    per-shard top k into the whole index's top k, which SklearnIndexer then
+    reranks and dedups as usual. Shards answer with the documents of their
+    hits, so materializing results needs no second round trip.
+
+    Without `addresses`, one local shard process is started per shard
+    directory; otherwise the shards are shard servers already running at
+    those (host, port) addresses, started with `python shards.py serve`.
+    """
+
+    def __init__(self, dirpath, shards, addresses=None):
+        self.offsets = [shard["offset"] for shard in shards]
+        self.sizes = [shard["num_docs"] for shard in shards]
+        self.processes = []
+        self._socket_dir = None
+        # Forked server workers share the local shard processes, and only
+        # the process that started them stops them.
+        self._owner = os.getpid()
+        self._pools = [queue.LifoQueue() for _ in shards]
+        if addresses is None:
+            self.authkey = secrets.token_hex(16).encode()
+            self.addresses = self._start_local(dirpath, shards)
+        else:
+            if len(addresses) != len(shards):
+                raise ValueError(f"{len(addresses)} shard addresses for {len(shards)} shards")
+            self.authkey = os.environ[AUTHKEY_ENV].encode()
+            self.addresses = list(addresses)
+        self._executor = ThreadPoolExecutor(max_workers=8 * len(shards))
+        # Documents returned with the current thread's last top_k
+        self._local = threading.local()
+        atexit.register(self.close)
+
+    def _start_local(self, dirpath, shards):
+        self._socket_dir = tempfile.mkdtemp(prefix="search-shards-")
+        env = dict(os.environ, **{AUTHKEY_ENV: self.authkey.decode()})
+        addresses = []
+        for number, shard in enumerate(shards):
+            address = os.path.join(self._socket_dir, f"{number}.sock")
+            self.processes.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve",
+                 os.path.join(os.path.abspath(dirpath), shard["path"]), "--socket", address],
+                env=env,
+            ))
+            addresses.append(address)
+
+        deadline = time.monotonic() + START_TIMEOUT
+        for process, address in zip(self.processes, addresses):
+            while True:
+                try:
+                    Client(address, authkey=self.authkey).close()
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        self.close()
+                        raise RuntimeError(f"Shard process for {address} did not start")
+                    time.sleep(0.05)
+        return addresses
+
+    def close(self):
+        for pool in self._pools:
+            while not pool.empty():
+                pool.get_nowait().close()
+        if os.getpid() != self._owner:
+            return
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            process.wait()
+        self.processes = []
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+    def _call(self, shard, request):
+        # Connections are pooled per shard; one carries one request at a time.
+        try:
+            conn = self._pools[shard].get_nowait()
+        except queue.Empty:
+            conn = Client(self.addresses[shard], authkey=self.authkey)
+        try:
+            conn.send(request)
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            raise
+        self._pools[shard].put(conn)
+        if status == "error":
+            raise RuntimeError(f"Shard {shard} failed: {value}")
+        return value
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def num_documents(self):
+        return sum(self.sizes)
+
+    def top_k(self, query_vectors, k):
+        """
+        Same contract as InvertedIndex.top_k, over every shard.
+        """
+        futures = [self._executor.submit(self._call, shard, ("top_k", query_vectors, k))
+                   for shard in range(len(self))]
+        ids, scores, documents = [], [], {}
+        boundary = -np.inf
+        for offset, future in zip(self.offsets, futures):
+            shard_ids, shard_scores, shard_boundary, shard_documents = future.result()
+            shard_ids = shard_ids.astype(np.int64) + offset
+            ids.append(shard_ids)
+            scores.append(shard_scores)
+            documents.update(zip(shard_ids.tolist(), shard_documents))
+            boundary = max(boundary, shard_boundary)
+        self._local.documents = documents
+
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        order = np.lexsort((ids, -scores))
+        if order.size > k:
+            order = order[:k]
+            boundary = max(boundary, scores[order[-1]])
+        return ids[order], scores[order], boundary
+
+    def get_document(self, doc_id):
+        documents = getattr(self._local, "documents", None)
+        if documents is not None and doc_id in documents:
+            return documents[doc_id]
+        shard = bisect_right(self.offsets, doc_id) - 1
+        return self._call(shard, ("documents", [doc_id - self.offsets[shard]]))[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shard of a sharded index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="serve a shard directory to a coordinator")
+    serve.add_argument("shard", help="shard directory, e.g. sklearn_index/shard-000")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=7100)
+    serve.add_argument("--socket", help="listen on this unix socket instead of host:port")
+    args = parser.parse_args()
+
+    if AUTHKEY_ENV not in os.environ:
+        parser.error(f"set {AUTHKEY_ENV} to the secret shared with the coordinator")
+    address = args.socket or (args.host, args.port)
+    serve_shard(args.shard, address, os.environ[AUTHKEY_ENV].encode())
+
+
+if __name__ == "__main__":
+    main()
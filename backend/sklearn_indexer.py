@@ -3,19 +3,38 @@ import pickle
 import math
 import time
 from collections import defaultdict
+from contextlib import nullcontext
 from nltk.corpus import stopwords
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import networkx as nx
+import numpy as np
+from inverted_index import fuse_scores
+from metrics import SEARCH_STAGE_SECONDS
+from graph_rank import LinkIndex, query_hits
+from result_cache import ResultCache
+from segments import SegmentedIndex, segments_path
+
+# Number of top cosine hits that get blended with link-analysis scores.
+RERANK_DEPTH = 50
+# Queries scored per sparse matrix product in search_batch.
+BATCH_CHUNK = 1024
+# Query-time HITS results kept per indexer, and for how many seconds.
+SUBGRAPH_CACHE_ENTRIES = 4096
+SUBGRAPH_CACHE_TTL = 3600
+
+def field_texts(metadata):
+    # Text indexed in the title and body fields of a document
+    title = ' '.join([metadata.get("title",""),metadata.get("keywords","")]).lower()
+    body = metadata.get("description","").lower()
+    return title, body
 
 class SklearnIndexer:
     def __init__(self):
-        self.metadata_store = {}
-        self.url_list = []
-        self.url_to_id = {}
-        self.graph = nx.DiGraph()
-        self.vectorizer = None
-        self.tfidf_matrix = None
+        # (from_id, to_id) rows of the link graph, and the same graph as
+        # out-/in-link lists for query-time HITS (built from edges if unset)
+        self.edges = None
+        self.link_index = None
+        # Links to urls that were not indexed, for pages added later
+        self.external_links = None
+        # PageRank/HITS scores, float arrays indexed by doc id
         self.pr_scores=None
         self.hubs=None
         self.authorities=None
@@ -23,6 +42,20 @@ class SklearnIndexer:
         self.title_tfidf_matrix = None
         self.body_vectorizer=None
         self.body_tfidf_matrix=None
+        self.inverted_index = None
+        # Optional LSA embeddings behind the "lsa" ranking algorithm
+        self.lsa = None
+        # Prefix completions served by /api/suggest
+        self.suggestions = None
+        # Query-time HITS scores, keyed by the candidate set they came from
+        self.subgraph_cache = ResultCache(SUBGRAPH_CACHE_ENTRIES, SUBGRAPH_CACHE_TTL)
+        # Columnar url/metadata records, indexed by doc id
+        self.doc_store = None
+        self.index_dir = None
+        # Set once documents are added or deleted after the build
+        self.segments = None
+        # Set when loaded from a sharded index; search goes through the shards
+        self.shards = None
         # self.term_boosts = {
         #     "libertarianism": 1.5,
         #     "socialism":      1.5,
@@ -38,123 +71,255 @@ class SklearnIndexer:
     def load_term_boosts(self, filepath):
         with open(filepath, 'r') as f:
             return json.load(f)
-        
-    def preprocess_text(self, metadata):
-        # text_parts = [
-        #     metadata.get("title", ""),
-        #     metadata.get("description", ""),
-        #     metadata.get("keywords", "")
-        # ]
-
-        # return ' '.join(text_parts).lower()
-        title       = metadata.get("title", "")
-        description = metadata.get("description", "")
-        keywords    = metadata.get("keywords", "")
-        # Repeat title 3×:
-        boosted_title = ' '.join([title]*3)
-        boosted_keywords = ' '.join([keywords]*3)
-        return ' '.join([boosted_title ,boosted_keywords]).lower()
-
-    def build_index(self, scraped_data):
-        documents = []
-        titles=[]
-        bodies = []
-
-        for idx, (url, data) in enumerate(scraped_data['web_graph'].items()):
-            metadata = data.get("metadata", {})
-            self.metadata_store[url] = metadata
-            self.url_to_id[url] = idx
-            self.url_list.append(url)
-            doc = self.preprocess_text(metadata)
-            bodies.append(metadata.get("description","").lower())
-            titles.append(' '.join([metadata.get("title",""),metadata.get("keywords","")]).lower())
-            documents.append(doc)
-
-        # Pass stop_words as a list
-        self.vectorizer = TfidfVectorizer(stop_words=self.stop_words)
-        self.tfidf_matrix = self.vectorizer.fit_transform(documents)
-
-        self.title_vectorizer=TfidfVectorizer(stop_words=self.stop_words)
-        self.title_tfidf_matrix=self.title_vectorizer.fit_transform(titles)
-
-        self.body_vectorizer=TfidfVectorizer(stop_words=self.stop_words)
-        self.body_tfidf_matrix=self.body_vectorizer.fit_transform(bodies)
-
-        # Build the link graph
-        for url, data in scraped_data['web_graph'].items():
-            from_id = self.url_to_id[url]
-            for out_url in data.get("links", []):
-                if out_url in self.url_to_id:
-                    to_id = self.url_to_id[out_url]
-                    self.graph.add_edge(from_id, to_id)
-
-        self.pr_scores = nx.pagerank(self.graph, alpha=0.85)
-        self.hubs, self.authorities = nx.hits(self.graph, max_iter = 50, normalized = True) 
-
-    def search(self, query, use_pagerank,use_hits,use_vector_space, top_k=5):
-
-        # q_vec = self.vectorizer.transform([query.lower()])
-
-        # # 2) boost the columns corresponding to your ideology terms
-        # for term, factor in self.term_boosts.items():
-        #     if term in self.vectorizer.vocabulary_:
-        #         idx = self.vectorizer.vocabulary_[term]
-        #         # multiply that dimension by your boost factor
-        #         q_vec[0, idx] *= factor
-        #         print(q_vec[0, idx])
-
-        # # 3) compute cosine similarity with each document
-        # cosine_scores = cosine_similarity(q_vec, self.tfidf_matrix).flatten()
-
-        # query_vec = self.vectorizer.transform([query])
-        # cosine_scores = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-        query_title = self.title_vectorizer.transform([query])
-        query_description = self.body_vectorizer.transform([query])
-        # cosine_scores = cosine_similarity(query_title, self.tfidf_matrix).flatten()
-
-
-        cosine_scores_title = cosine_similarity(query_title, self.title_tfidf_matrix).flatten()
-        cosine_scores_body = cosine_similarity(query_description, self.body_tfidf_matrix).flatten()
-        
-        print(len(cosine_scores_title),len(cosine_scores_body))
-        cosine_scores = (2.0 * cosine_scores_title)/3 + (1.0 * cosine_scores_body)/3
-
-        scores = {idx: score for idx, score in enumerate(cosine_scores) if score > 0}
-        top_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:50]
 
-        if use_pagerank:
-            print("Page Rank")
-            
-            for doc_id, _ in top_docs:
-                scores[doc_id] = 0.7 * scores[doc_id] + 0.4 * self.pr_scores.get(doc_id, 0)
+    def build_index(self, scraped_data, workers=None, collapse_near_duplicates=True,
+                    lsa_dimensions=None):
+        # Tokenization runs in a process pool and the field matrices and link
+        # analysis are built concurrently; see build_pipeline.
+        from build_pipeline import build_index_parallel
+        return build_index_parallel(self, scraped_data['web_graph'].items(), workers,
+                                    collapse_near_duplicates=collapse_near_duplicates,
+                                    lsa_dimensions=lsa_dimensions)
+
+    def search(self, query, use_pagerank,use_hits,use_vector_space, top_k=5, use_lsa=False,
+               ranked=False, use_query_hits=False):
+        # ranked=True returns the results as (doc ids, scores) arrays, which
+        # materialize() turns into result dicts later; pagination keeps those.
+        # use_query_hits reranks with HITS run on the top candidates' link
+        # neighbourhood instead of the global hub/authority scores.
+        if use_lsa:
+            return self._search_lsa(query, top_k, ranked)
+        if self.segments is not None:
+            # Hold the segment lock until results are materialized so a merge
+            # cannot renumber doc ids in between
+            with self.segments.lock:
+                with SEARCH_STAGE_SECONDS.time(stage="segment_score"):
+                    candidates, scores = self.segments.score(query)
+                return self.rank_candidates(candidates, scores, use_pagerank, use_hits, top_k,
+                                            ranked, use_query_hits)
+
+        with SEARCH_STAGE_SECONDS.time(stage="vectorize"):
+            query_title = self.title_vectorizer.transform([query])
+            query_description = self.body_vectorizer.transform([query])
+
+        # Only the posting lists of the query terms are read, with MaxScore
+        # pruning against the current top-k threshold.
+        query_vectors = {"title": query_title, "body": query_description}
+        index = self.inverted_index if self.shards is None else self.shards
+        return self._rank(lambda pool_size: index.top_k(query_vectors, pool_size),
+                          use_pagerank, use_hits, top_k, ranked, use_query_hits)
+
+    def _search_lsa(self, query, top_k, ranked=False):
+        if self.lsa is None:
+            raise ValueError("This index has no LSA embeddings; build it with "
+                             "prepare_sklearn_index.py --lsa")
+        with SEARCH_STAGE_SECONDS.time(stage="vectorize"):
+            query_vectors = {"title": self.title_vectorizer.transform([query]),
+                             "body": self.body_vectorizer.transform([query])}
+        with SEARCH_STAGE_SECONDS.time(stage="lsa_score"):
+            candidates, scores = self.lsa.score(query_vectors)
+        return self.rank_candidates(candidates, scores, False, False, top_k, ranked)
+
+    def search_batch(self, queries, algorithm="tfidf", top_k=5):
+        use_pagerank = algorithm == "pagerank"
+        use_hits = algorithm == "hits"
+        if algorithm == "lsa":
+            return [self._search_lsa(query, top_k) for query in queries]
+        if algorithm == "query_hits":
+            return [self.search(query, False, False, False, top_k, use_query_hits=True)
+                    for query in queries]
+        if self.segments is not None or self.shards is not None:
+            return [self.search(query, use_pagerank, use_hits, not (use_pagerank or use_hits), top_k)
+                    for query in queries]
+        results = []
+        for start in range(0, len(queries), BATCH_CHUNK):
+            chunk = queries[start:start + BATCH_CHUNK]
+            with SEARCH_STAGE_SECONDS.time(stage="batch_vectorize"):
+                query_titles = self.title_vectorizer.transform(chunk)
+                query_descriptions = self.body_vectorizer.transform(chunk)
+
+            # One sparse product per field for the whole chunk; rows stay sparse
+            # so only documents sharing a term with the query are touched.
+            # Rows on both sides are L2-normalized, so products are cosines.
+            with SEARCH_STAGE_SECONDS.time(stage="batch_score"):
+                title_scores = self._field_scores(query_titles, self.title_tfidf_matrix)
+                body_scores = self._field_scores(query_descriptions, self.body_tfidf_matrix)
+                fused = fuse_scores(title_scores, body_scores).tocsr()
+                fused.sort_indices()
+
+            for row in range(fused.shape[0]):
+                lo, hi = fused.indptr[row], fused.indptr[row + 1]
+                ids = fused.indices[lo:hi]
+                scores = fused.data[lo:hi]
+                positive = scores > 0
+                results.append(self.rank_candidates(ids[positive], scores[positive],
+                                                    use_pagerank, use_hits, top_k))
+        return results
+
+    def _field_scores(self, queries, matrix):
+        # (queries x docs) scores. Multiplying from the document side with the
+        # queries cast to float32 uses the stored CSR matrix without a copy.
+        product = matrix @ queries.T.astype(matrix.dtype)
+        return product.T.astype(np.float64)
+
+    def rank_candidates(self, candidates, candidate_scores, use_pagerank, use_hits, top_k=5,
+                        ranked=False, use_query_hits=False):
+        # candidates must be sorted by doc id.
+        return self._rank(lambda pool_size: self._top_pool(candidates, candidate_scores, pool_size),
+                          use_pagerank, use_hits, top_k, ranked, use_query_hits)
+
+    def _rank(self, top_pool, use_pagerank, use_hits, top_k, ranked=False, use_query_hits=False):
+        # top_pool(n) returns the n best (ids, scores) by cosine plus an upper
+        # bound on every score left out. Rank a small pool first and only widen
+        # it when dedup runs out of results guaranteed to beat the rest.
+        if top_k <= 0:
+            return (np.empty(0, dtype=np.int64), np.empty(0)) if ranked else []
+        pool_size = RERANK_DEPTH + 2 * top_k
+        while True:
+            with SEARCH_STAGE_SECONDS.time(stage="score"):
+                ids, scores, boundary = top_pool(pool_size)
+            with SEARCH_STAGE_SECONDS.time(stage="rerank"):
+                ids, scores = self._rerank(ids, scores, use_pagerank, use_hits, use_query_hits)
+            with SEARCH_STAGE_SECONDS.time(stage="materialize"):
+                hits = self._dedup_results(ids, scores, boundary, top_k)
+                if hits is not None and not ranked:
+                    return [self._result(url, meta, score) for _, score, url, meta in hits]
+            if hits is not None:
+                return (np.array([hit[0] for hit in hits], dtype=np.int64),
+                        np.array([hit[1] for hit in hits], dtype=np.float64))
+            pool_size *= 2
+
+    def _top_pool(self, candidates, candidate_scores, pool_size):
+        if pool_size < candidates.size:
+            kth = candidate_scores.size - pool_size
+            threshold = np.partition(candidate_scores, kth)[kth]
+            # Keep every tie at the threshold so tie-breaking stays by doc id.
+            in_pool = candidate_scores >= threshold
+            outside = candidate_scores[~in_pool]
+            boundary = outside.max() if outside.size else -np.inf
+            ids = candidates[in_pool]
+            scores = candidate_scores[in_pool]
+        else:
+            ids = candidates
+            scores = candidate_scores
+            boundary = -np.inf
 
+        order = np.lexsort((ids, -scores))
+        return ids[order], scores[order], boundary
+
+    def _rerank(self, ids, scores, use_pagerank, use_hits, use_query_hits=False):
+        # ids/scores arrive sorted by cosine; blend link scores into the head.
+        scores = scores.copy()
+        top = slice(0, RERANK_DEPTH)
+        if use_pagerank:
+            pr, _, _ = self._graph_score_arrays()
+            scores[top] = 0.7 * scores[top] + 0.4 * pr[ids[top]]
         elif use_hits:
-            print("Hit Algorithm")
-            
-            # print(local_auths," = ",_,)
-            for doc_id, _ in top_docs:
-                scores[doc_id] = 0.7 * scores[doc_id] + 0.2 * self.authorities.get(doc_id, 0) + 0.2 * self.hubs.get(doc_id, 0)
+            _, hubs, authorities = self._graph_score_arrays()
+            scores[top] = 0.7 * scores[top] + 0.2 * authorities[ids[top]] + 0.2 * hubs[ids[top]]
+        elif use_query_hits:
+            hubs, authorities = self._query_hits(ids[top])
+            scores[top] = 0.7 * scores[top] + 0.2 * authorities + 0.2 * hubs
         else:
-            print("Vector Space")
-            
-        ranked_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            return ids, scores
+
+        order = np.lexsort((ids, -scores))
+        return ids[order], scores[order]
+
+    def _query_hits(self, root):
+        # The pool only widens past the rerank depth, so every round of one
+        # query has the same root set.
+        links = self._link_index()
+        key = (root.tobytes(), self.segments.generation if self.segments is not None else 0)
+        with SEARCH_STAGE_SECONDS.time(stage="query_hits"):
+            return self.subgraph_cache.get_or_compute(key, lambda: query_hits(links, root))
+
+    def _link_index(self):
+        if self.segments is not None:
+            return self.segments.link_index()
+        if self.link_index is None:
+            self.link_index = LinkIndex.from_edges(self.edges, len(self.pr_scores))
+        return self.link_index
+
+    def _dedup_results(self, ids, scores, boundary, top_k):
+        # (doc id, score, url, metadata) of the results. Returns None when the
+        # pool was exhausted before top_k unique titles were found among
+        # scores that are known to outrank the rest.
         seen_titles = set()
         results = []
-       
-        for doc_id, score in ranked_results:
-            url = self.url_list[doc_id]
-            # results[url] = self.metadata_store[url]
-            meta = self.metadata_store[url]
+        for doc_id, score in zip(ids.tolist(), scores.tolist()):
+            if score <= boundary:
+                return None
+            url, meta = self.get_document(doc_id)
             title = meta.get("title", "")[:200].strip()
             if title in seen_titles:
                 continue
             seen_titles.add(title)
-            results.append({
-                "title": meta.get("title", "")[:200],
-                "url": url,
-                "score":score,
-                "snippet": meta.get("description", "")[:300]
-            })
-        # print(results)
-        return results
+            results.append((doc_id, score, url, meta))
+            if len(results) == top_k:
+                return results
+        return results if boundary == -np.inf else None
+
+    def _result(self, url, meta, score):
+        return {
+            "title": meta.get("title", "")[:200],
+            "url": url,
+            "score":score,
+            "snippet": meta.get("description", "")[:300]
+        }
+
+    def materialize(self, ids, scores):
+        """
+        Result dicts of doc ids and scores returned by search(ranked=True).
+        """
+        # Under the segment lock, as in search, so doc ids cannot be renumbered
+        lock = self.segments.lock if self.segments is not None else nullcontext()
+        with SEARCH_STAGE_SECONDS.time(stage="materialize"), lock:
+            return [self._result(*self.get_document(doc_id), score)
+                    for doc_id, score in zip(ids.tolist(), scores.tolist())]
+
+    def add_documents(self, web_graph, refresh_graph=True):
+        # Pages in the crawler's web_graph shape go into a new segment; the
+        # built index becomes the first segment on the first update.
+        self._segmented().add_documents(web_graph)
+        if refresh_graph:
+            self.segments.refresh_graph()
+
+    def delete_documents(self, urls, refresh_graph=True):
+        self._segmented().delete_documents(urls)
+        if refresh_graph:
+            self.segments.refresh_graph()
+
+    def _segmented(self):
+        if self.shards is not None:
+            raise ValueError("Sharded indexes are not updated in place; rebuild them with "
+                             "prepare_sklearn_index.py --shards")
+        if self.segments is None:
+            path = segments_path(self.index_dir) if self.index_dir else None
+            self.segments = SegmentedIndex.from_indexer(self, path)
+            # The embeddings only cover the built documents
+            self.lsa = None
+        return self.segments
+
+    def get_document(self, doc_id):
+        if self.segments is not None:
+            return self.segments.get_document(doc_id)
+        if self.shards is not None:
+            return self.shards.get_document(doc_id)
+        return self.doc_store[doc_id]
+
+    def iter_documents(self):
+        for doc_id in range(self.num_documents()):
+            yield self.get_document(doc_id)
+
+    def num_documents(self):
+        if self.segments is not None:
+            return self.segments.num_documents()
+        if self.shards is not None:
+            return self.shards.num_documents()
+        return len(self.doc_store) if self.doc_store is not None else 0
 
+    def _graph_score_arrays(self):
+        if self.segments is not None:
+            return self.segments.graph_score_arrays()
+        return self.pr_scores, self.hubs, self.authorities
@@ -0,0 +1,161 @@
+import os
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+# Completions returned per request at most, and precomputed per prefix
+SUGGESTIONS = 8
+# Titles and keywords longer than this are not offered as completions.
+MAX_SUGGESTION_CHARS = 80
+# Prefixes matching more completions than this have their top SUGGESTIONS
+# precomputed; the completions of rarer prefixes are ranked per request.
+SCAN_LIMIT = 64
+
+
+def normalize_prefix(text):
+    """
+    Lowercased with whitespace runs collapsed; a trailing space is kept so
+    "karl " completes to "karl marx" but not "karlsruhe".
+    """
+    normalized = " ".join(text.lower().split())
+    if normalized and text[-1:].isspace():
+        normalized += " "
+    return normalized
+
+
+class Strings:
+    """
+    Read-only sequence of strings stored as one UTF-8 buffer and an offset
+    array, like a DocStore column; bisect works on it directly.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    @classmethod
+    def encode(cls, strings):
+        buffer, offsets = bytearray(), array('q', [0])
+        for string in strings:
+            buffer += string.encode("utf-8")
+            offsets.append(len(buffer))
+        return cls(np.frombuffer(buffer, dtype=np.uint8), np.frombuffer(offsets, dtype=np.int64))
+
+
+class SuggestIndex:
+    """
+    Prefix autocomplete over indexed titles and keywords and the terms.json
+    vocabulary, weighted by PageRank: a title or keyword weighs the PageRank
+    of the pages it appears on, and a vocabulary term the PageRank of the
+    pages containing it times its boost.
+
+    Completions are sorted by normalized text, so the completions of a
+    prefix are one contiguous range found by binary search. Prefixes with
+    more than SCAN_LIMIT completions (the "heads") have their top
+    SUGGESTIONS stored, so no request ranks more than SCAN_LIMIT of them.
+    """
+
+    def __init__(self, keys, texts, weights, heads, head_top):
+        # Normalized completions, sorted, and how each is displayed
+        self.keys = keys
+        self.texts = texts
+        self.weights = weights
+        # Sorted head prefixes and their best completions, padded with -1
+        self.heads = heads
+        self.head_top = head_top
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, indexer):
+        pr = np.asarray(indexer._graph_score_arrays()[0], dtype=np.float64)
+        completions = {}
+
+        def add(text, weight):
+            text = " ".join(text.split())
+            if not text or len(text) > MAX_SUGGESTION_CHARS:
+                return
+            key = text.lower()
+            entry = completions.get(key)
+            if entry is None:
+                completions[key] = [weight, text, weight]
+            else:
+                entry[0] += weight
+                # Shown the way the highest-ranked page writes it
+                if weight > entry[2]:
+                    entry[1], entry[2] = text, weight
+
+        documents = indexer.doc_store
+        for doc_id in range(len(documents)):
+            add(documents.value(doc_id, "title"), pr[doc_id])
+            for keyword in documents.value(doc_id, "keywords").split(","):
+                add(keyword, pr[doc_id])
+
+        for term, boost in indexer.term_boosts.items():
+            pages = np.zeros(len(pr), dtype=bool)
+            for field in ("title", "body"):
+                column = getattr(indexer, field + "_vectorizer").vocabulary_.get(term)
+                if column is not None:
+                    pages[indexer.inverted_index.fields[field].postings(column)[0]] = True
+            add(term, boost * pr[pages].sum())
+
+        keys = sorted(completions)
+        weights = np.array([completions[key][0] for key in keys], dtype=np.float32)
+        texts = [completions[key][1] for key in keys]
+        heads, head_top = cls._precompute_heads(keys, weights)
+        return cls(Strings.encode(keys), Strings.encode(texts), weights,
+                   Strings.encode(heads), head_top)
+
+    @staticmethod
+    def _precompute_heads(keys, weights):
+        # A prefix has more than SCAN_LIMIT completions exactly when it is
+        # shared by two keys SCAN_LIMIT apart in sorted order.
+        heads = set()
+        for first, last in zip(keys, keys[SCAN_LIMIT:]):
+            length = len(os.path.commonprefix([first, last]))
+            heads.update(first[:i] for i in range(1, length + 1))
+        heads = sorted(heads)
+        head_top = np.full((len(heads), SUGGESTIONS), -1, dtype=np.int32)
+        for row, head in enumerate(heads):
+            lo = bisect_left(keys, head)
+            hi = bisect_left(keys, _successor(head), lo)
+            top = lo + _best(weights[lo:hi], SUGGESTIONS)
+            head_top[row, :len(top)] = top
+        return heads, head_top
+
+    def suggest(self, prefix, limit=SUGGESTIONS):
+        """
+        Display texts of the best `limit` (at most SUGGESTIONS) completions
+        of `prefix`, highest weight first.
+        """
+        prefix = normalize_prefix(prefix)
+        if not prefix or limit <= 0:
+            return []
+        limit = min(limit, SUGGESTIONS)
+        row = bisect_left(self.heads, prefix)
+        if row < len(self.heads) and self.heads[row] == prefix:
+            ids = [i for i in self.head_top[row, :limit].tolist() if i >= 0]
+        else:
+            lo = bisect_left(self.keys, prefix)
+            # Not a head, so at most SCAN_LIMIT keys start with this prefix
+            hi = bisect_left(self.keys, _successor(prefix), lo, min(lo + SCAN_LIMIT, len(self.keys)))
+            ids = (lo + _best(self.weights[lo:hi], limit)).tolist()
+        return [self.texts[i] for i in ids]
+
+
+def _successor(prefix):
+    # The smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _best(weights, n):
+    # Indices of the n largest weights, largest first; ties keep key order
+    order = np.argsort(-np.asarray(weights, dtype=np.float64), kind="stable")
+    return order[:n]
@@ -0,0 +1,42 @@
+import argparse
+import time
+from build_pipeline import iter_pages
+from index_store import load_index
+from segments import MERGE_FACTOR
+
+INDEX_DIR = "sklearn_index"
+
+parser = argparse.ArgumentParser(description="Add or delete pages in the built index without a full rebuild.")
+parser.add_argument("pages", nargs="?",
+                    help="crawl output (shard directory, .jsonl(.gz), .json or .pkl) whose pages are "
+                         "added, e.g. a --refresh crawl; they replace indexed pages with the same url")
+parser.add_argument("--delete", nargs="*", default=[], help="urls to remove from the index")
+parser.add_argument("--no-merge", action="store_true",
+                    help="leave segments unmerged; by default they are merged whenever there are "
+                         f"more than {MERGE_FACTOR}")
+args = parser.parse_args()
+
+print(f"🔁 Loading {INDEX_DIR}/...")
+indexer = load_index(INDEX_DIR)
+start_time = time.time()
+
+if args.pages:
+    web_graph = {}
+    for url, page in iter_pages(args.pages):
+        # The last record of a url is its newest fetch
+        web_graph[url] = page
+    print(f"➕ Adding {len(web_graph)} pages...")
+    indexer.add_documents(web_graph, refresh_graph=not args.delete)
+
+if args.delete:
+    print(f"➖ Deleting {len(args.delete)} pages...")
+    indexer.delete_documents(args.delete)
+
+# This is the only process that writes segments, so it compacts them too:
+# merging in the server would race this script for the index directory.
+if not args.no_merge and indexer.segments is not None:
+    while indexer.segments.merge():
+        pass
+
+print(f"✅ Index updated in {time.time() - start_time:.2f}s "
+      f"({len(indexer.segments.segments) if indexer.segments else 0} segments).")
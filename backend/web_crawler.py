@@ -1,260 +1,348 @@
+import argparse
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import urllib.parse
-import json
+import codecs
+import hashlib
+import os
+import pickle
+import re
+import shelve
 import time
-from lxml import html as lxml_html
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from crawl_store import (CRAWL_DIR, REFRESH_DIR, VALIDATORS, CrawlGraph, ShardWriter,
+                         load_checkpoint, write_checkpoint)
+from frontier import HOST_DELAY, Frontier
+from near_duplicates import NearDuplicateIndex, fingerprint
+from page_extractor import extract_page
+
+# Pages are read up to MAX_PAGE_BYTES (after decompression) and the rest is
+# dropped; titles, meta tags and most links come well before that.
+MAX_PAGE_BYTES = 512 * 1024
+READ_CHUNK = 64 * 1024
+# Seconds to open a connection, to wait for each read of the body, and for
+# the whole fetch.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 5
+FETCH_TIMEOUT = 15
+# Resolved addresses are reused for this many seconds, and idle connections
+# kept open longer than the frontier's delay between two fetches of a host.
+DNS_CACHE_SECONDS = 600
+KEEPALIVE_SECONDS = max(30, 4 * HOST_DELAY)
+# Hosts listed in the throughput report at the end of a crawl
+REPORT_HOSTS = 10
+# Pages without a charset in their Content-Type are decoded in the one a
+# <meta charset> or <meta http-equiv="Content-Type"> tag declares within
+# their first CHARSET_SNIFF_BYTES, as browsers do.
+CHARSET_SNIFF_BYTES = 1024
+META_CHARSET = re.compile(rb"""<meta[^>]*?charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+
+# aiohttp decodes brotli responses only when a brotli module is installed
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+def decode_html(body, charset=None, complete=True):
+    """
+    Text of an HTML body in `charset`, else the charset its <meta> tags
+    declare, else UTF-8, falling back to cp1252 for bytes that are not
+    UTF-8. complete=False leaves out a character cut off at the end of a
+    truncated body.
+    """
+    if not charset:
+        match = META_CHARSET.search(body, 0, CHARSET_SNIFF_BYTES)
+        charset = match.group(1).decode("ascii") if match else None
+        # A page that could read its own <meta> tag is not UTF-16
+        if charset and charset.lower().startswith("utf-16"):
+            charset = "utf-8"
+    if charset:
+        try:
+            return codecs.getincrementaldecoder(charset)(errors="replace").decode(body, complete)
+        except LookupError:
+            pass
+    try:
+        return codecs.getincrementaldecoder("utf-8")().decode(body, complete)
+    except UnicodeDecodeError:
+        return body.decode("cp1252", errors="replace")
+
 
 class WebCrawler:
-    def __init__(self, seeds, max_pages=100000, concurrent_tasks=50, incremental_interval=1000):
+    def __init__(self, seeds, max_pages=100000, concurrent_tasks=50, incremental_interval=1000,
+                 output_dir=CRAWL_DIR, parse_workers=None, resume=False, refresh=False,
+                 validators_path=None):
         """
-        Initialize the web crawler.
+        Initialize the web crawler. Accepted pages are appended to compressed
+        shards in output_dir, and their links to the crawl graph there as
+        integer ids, flushed to disk every incremental_interval pages
+        together with a checkpoint that resume=True continues from.
+        HTML is parsed in a pool of parse_workers processes (default: one per
+        core), separately from the concurrent_tasks fetching pages.
+
+        ETag, Last-Modified and a content hash of every fetched page are kept
+        in the validators_path shelf (default: inside output_dir). refresh=True
+        revisits every url in it with conditional requests and only extracts
+        pages that changed.
         """
-        self.frontier = asyncio.Queue()
-        for seed in seeds:
-            self.frontier.put_nowait(seed)
-
-        self.visited = set()
-        self.web_graph = {}
+        self.frontier = Frontier(seeds)
         self.seen_titles = set()
+        self.near_duplicates = NearDuplicateIndex()
 
         self.max_pages = max_pages
         self.concurrent_tasks = concurrent_tasks
         self.pages_crawled = 0
+        self.pages_unchanged = 0
         self.incremental_interval = incremental_interval
+        self.output = ShardWriter(output_dir)
+        self.graph = CrawlGraph(output_dir)
+        self.validators = shelve.open(validators_path or os.path.join(output_dir, VALIDATORS))
+        # Validators of pages fetched since the last update, saved to the
+        # shelf once that update is on disk
+        self.pending_validators = {}
+        self.parse_workers = parse_workers
+        self.parser_pool = None
         self.session = None
-
-    def is_english(self, html_text):
-        """
-        Return False if the page explicitly declares a non-English language
-        via <html lang="..."> or meta http-equiv/content-language or meta[name=language].
-        Otherwise True.
-        """
-        soup = BeautifulSoup(html_text, "lxml")
-        # 1) <html lang="...">
-        if soup.html and soup.html.has_attr("lang"):
-            lang = soup.html["lang"].strip().lower()
-            if not lang.startswith("en"):
-                return False
-        # 2) <meta http-equiv="content-language" content="...">
-        meta_http = soup.find("meta", attrs={"http-equiv": "content-language"})
-        if meta_http and meta_http.get("content"):
-            lang = meta_http["content"].split(",")[0].strip().lower()
-            if not lang.startswith("en"):
-                return False
-        # 3) <meta name="language" content="...">
-        meta_name = soup.find("meta", attrs={"name": "language"})
-        if meta_name and meta_name.get("content"):
-            lang = meta_name["content"].strip().lower()
-            if not lang.startswith("en"):
-                return False
-        return True
-
-    async def fetch(self, url):
+        # host -> [fetches, bytes read, seconds spent fetching]
+        self.host_stats = defaultdict(lambda: [0, 0, 0.0])
+        self.pages_truncated = 0
+
+        if resume:
+            checkpoint = load_checkpoint(output_dir)
+            if checkpoint is not None:
+                self.pages_crawled = checkpoint["pages_crawled"]
+                self.seen_titles = checkpoint["seen_titles"]
+                self.near_duplicates = checkpoint["near_duplicates"]
+                self.frontier.restore(checkpoint["frontier"])
+                print(f"[resume] pages_crawled={self.pages_crawled}, queued={len(self.frontier)}")
+        if refresh:
+            for url in self.validators.keys():
+                self.frontier.add(url, 0)
+
+    async def fetch(self, url, validators=None):
         """
-        Asynchronously fetch a web page.
+        Asynchronously fetch a web page, conditionally if the (etag,
+        last_modified, content_hash) validators of an earlier fetch are given.
+        Returns (status, html_text, etag, last_modified); html_text is None
+        unless an HTML page came back, and holds at most MAX_PAGE_BYTES of it.
+        The bytes read and time taken are added to host_stats.
         """
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        if validators is not None:
+            etag, last_modified, _ = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        start = time.perf_counter()
+        size = 0
         try:
-            async with self.session.get(url, timeout=10) as resp:
+            async with self.session.get(url, headers=headers) as resp:
                 ct = resp.headers.get("content-type", "")
                 if resp.status == 200 and "text/html" in ct:
-                    return await resp.text()
+                    body = bytearray()
+                    while len(body) < MAX_PAGE_BYTES:
+                        chunk = await resp.content.read(READ_CHUNK)
+                        if not chunk:
+                            break
+                        body += chunk
+                    size = len(body)
+                    truncated = size >= MAX_PAGE_BYTES and not resp.content.at_eof()
+                    if truncated:
+                        # The connection is dropped rather than drained of
+                        # the rest of the page
+                        self.pages_truncated += 1
+                        del body[MAX_PAGE_BYTES:]
+                        resp.close()
+                    html_text = decode_html(body, resp.charset, complete=not truncated)
+                    return (resp.status, html_text,
+                            resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+                return resp.status, None, None, None
         except:
             pass
-        return None
-
-    def extract_links(self, doc, base_url):
-        """
-        Normalize and filter outgoing HTTP(S) links.
-        """
-        links = []
-        for href in doc.xpath("//a[@href]/@href"):
-            if href.startswith(("javascript:", "mailto:", "tel:", "#")):
-                continue
-            absu = urllib.parse.urljoin(str(base_url), href)
-            absu = urllib.parse.urldefrag(absu)[0]
-            p = urlparse(absu)
-            if p.scheme not in ("http", "https"):
-                continue
-            norm = urllib.parse.urlunparse((
-                p.scheme, p.netloc.lower(), p.path.rstrip("/"),
-                "", p.query, ""
-            ))
-            links.append(norm)
-        # dedupe preserving order
-        seen = set()
-        unique = []
-        for u in links:
-            if u not in seen:
-                seen.add(u)
-                unique.append(u)
-        return unique
-
-    def extract_metadata(self, html_text, base_url):
-        """
-        Extract title, description, and keywords with robust fallbacks.
-        """
-        soup = BeautifulSoup(html_text, "lxml")
-
-        # --- Title ---
-        title = soup.title.string.strip() if soup.title and soup.title.string else ""
-
-        # --- Description meta fallbacks ---
-        description = ""
-        # 1) <meta name="description">
-        m = soup.find("meta", {"name": "description"})
-        if m:
-            desc = m.get("content", "").strip()
-            if len(desc) >= 30 and " " in desc:
-                description = desc
-
-        # 2) Open Graph
-        if not description:
-            og = soup.find("meta", property="og:description")
-            if og:
-                desc = og.get("content", "").strip()
-                if len(desc) >= 30 and " " in desc:
-                    description = desc
-
-        # 3) Twitter
-        if not description:
-            tw = soup.find("meta", {"name": "twitter:description"})
-            if tw:
-                desc = tw.get("content", "").strip()
-                if len(desc) >= 30 and " " in desc:
-                    description = desc
-
-        # 4) Wikipedia-specific fallback
-        if not description and "wikipedia.org" in base_url:
-            container = soup.find("div", class_="mw-parser-output")
-            if container:
-                for p in container.find_all("p"):
-                    text = p.get_text().strip()
-                    if len(text) >= 80 and not text.startswith(("Coordinates", "This is", "[")):
-                        description = text
-                        break
-
-        # 5) Generic <p> scan ≥80 chars
-        if not description:
-            for p in soup.find_all("p"):
-                text = p.get_text().strip()
-                if len(text) >= 80:
-                    description = text
-                    break
-
-        # 6) Final fallback
-        if not description and (p := soup.find("p")):
-            description = p.get_text().strip()
-
-        # --- Keywords fallbacks ---
-        keywords = ""
-        kw = soup.find("meta", {"name": "keywords"})
-        if kw and kw.get("content", "").strip():
-            keywords = kw["content"].strip()
-        elif nk := soup.find("meta", {"name": "news_keywords"}):
-            keywords = nk.get("content", "").strip()
-        elif ogk := soup.find("meta", property="og:keywords"):
-            keywords = ogk.get("content", "").strip()
-        elif twk := soup.find("meta", {"name": "twitter:keywords"}):
-            keywords = twk.get("content", "").strip()
-        elif "wikipedia.org" in base_url:
-            # Wikipedia categories
-            cat_div = soup.find("div", id="mw-normal-catlinks")
-            if cat_div:
-                cats = [a.get_text().strip() for a in cat_div.find_all("a")[1:]]
-                keywords = ", ".join(cats)
-        if not keywords and title:
-            keywords = title
-
-        return {"title": title, "description": description, "keywords": keywords}
-
-    async def process_page(self, url):
+        finally:
+            stats = self.host_stats[urlsplit(url).hostname]
+            stats[0] += 1
+            stats[1] += size
+            stats[2] += time.perf_counter() - start
+        return None, None, None, None
+
+    async def process_page(self, url, depth=0):
         """
         Fetch, parse, enforce English + unique-title + non-empty metadata, then add to graph.
         """
-        if url in self.visited:
+        known = self.pending_validators.get(url) or self.validators.get(url)
+        status, html_text, etag, last_modified = await self.fetch(url, known)
+        if status == 304:
+            self.pages_unchanged += 1
             return
-
-        html_text = await self.fetch(url)
         if not html_text:
             return
 
-        # Skip non-English pages
-        if not self.is_english(html_text):
-            self.visited.add(url)
+        # Servers without validators still get caught by the content hash
+        content_hash = hashlib.blake2b(html_text.encode("utf-8"), digest_size=16).hexdigest()
+        self.pending_validators[url] = (etag, last_modified, content_hash)
+        if known is not None and known[2] == content_hash:
+            self.pages_unchanged += 1
             return
 
-        self.visited.add(url)
-        self.pages_crawled += 1
+        # Language check, metadata and links come from one parse of the page,
+        # done in the parser pool so fetches keep running meanwhile
+        extracted = await asyncio.get_running_loop().run_in_executor(
+            self.parser_pool, extract_page, html_text, url)
+        if extracted is None:
+            self.pages_crawled += 1
+            return
+        english, meta, links = extracted
 
-        # Parse for links
-        try:
-            doc = lxml_html.fromstring(html_text)
-        except:
+        # Skip non-English pages
+        if not english:
             return
 
-        # Extract metadata
-        meta = self.extract_metadata(html_text, url)
+        self.pages_crawled += 1
         title = meta["title"]
 
-        # Enforce unique titles
-        if title and title in self.seen_titles:
+        # Enforce unique titles, and skip near-duplicates of accepted pages
+        # (mirrors, print views, url variants with a slightly different title)
+        if title and title in self.seen_titles or \
+                self.near_duplicates.check_add(fingerprint(meta), url) is not None:
             # still enqueue links
-            for link in self.extract_links(doc, url):
-                if link not in self.visited and self.pages_crawled < self.max_pages:
-                    await self.frontier.put(link)
+            self.enqueue_links(links, depth)
             return
 
         if title:
             self.seen_titles.add(title)
 
-        # Extract & enqueue links
-        links = self.extract_links(doc, url)
-        for link in links:
-            if link not in self.visited and self.pages_crawled < self.max_pages:
-                await self.frontier.put(link)
+        # Enqueue links
+        self.enqueue_links(links, depth)
 
         # Only add pages with some metadata
         if title or meta["description"] or meta["keywords"]:
-            self.web_graph[url] = {"metadata": meta, "links": links}
+            page_id, edges = self.graph.add_page(url, links)
+            self.output.write(url, {"metadata": meta, "links": links, "id": page_id,
+                                    "edges": edges})
 
         # Periodic save
         if self.pages_crawled % self.incremental_interval == 0:
             self.incremental_update()
 
+    def enqueue_links(self, links, depth):
+        """
+        Queue links found on a page `depth` links from the seeds; the
+        frontier drops any url it has already seen.
+        """
+        if self.pages_crawled < self.max_pages:
+            for link in links:
+                self.frontier.add(link, depth + 1)
+
     def incremental_update(self):
         """
-        Save an incremental JSON snapshot.
+        Flush the crawl graph and the pages accepted since the last update to
+        disk, then checkpoint the crawl state. Compression, writing and fsync
+        run on the writer's own thread, so the checkpoint never gets ahead of
+        the shards.
+
+        The validators of the pages fetched meanwhile are saved only after
+        that: saved earlier, a crash would leave pages that were never
+        written but that a resumed crawl skips as unchanged.
         """
-        data = {
+        self.graph.flush(self.output)
+        self.output.flush()
+        state = pickle.dumps({
             "pages_crawled": self.pages_crawled,
-            "web_graph": self.web_graph
-        }
-        with open("incremental_update.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        print(f"[update] pages_crawled={self.pages_crawled}, graph_size={len(self.web_graph)}")
+            "seen_titles": self.seen_titles,
+            "near_duplicates": self.near_duplicates,
+            "frontier": self.frontier.snapshot(),
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        validators, self.pending_validators = self.pending_validators, {}
+        written = self.output.run(write_checkpoint, self.output.directory, state)
+        loop = asyncio.get_running_loop()
+
+        def saved(future):
+            if future.exception() is None:
+                loop.call_soon_threadsafe(self._save_validators, validators)
+
+        written.add_done_callback(saved)
+        print(f"[update] pages_crawled={self.pages_crawled}, graph_size={self.graph.pages}, "
+              f"urls={len(self.graph)}")
+
+    def _save_validators(self, validators):
+        # On the event loop thread, the only one using the shelf
+        self.validators.update(validators)
+        self.validators.sync()
 
     async def worker(self):
         while self.pages_crawled < self.max_pages:
-            url = await self.frontier.get()
+            item = await self.frontier.get()
+            if item is None:
+                return
+            url, depth = item
             try:
-                await self.process_page(url)
+                await self.process_page(url, depth)
             except:
                 pass
             finally:
-                self.frontier.task_done()
+                self.frontier.release(url)
+
+    def report_hosts(self, limit=REPORT_HOSTS):
+        """
+        Print fetches, bytes and throughput of the `limit` hosts most
+        bytes were read from.
+        """
+        busiest = sorted(self.host_stats.items(), key=lambda item: -item[1][1])[:limit]
+        for host, (fetches, size, seconds) in busiest:
+            rate = size / seconds / 1024 if seconds else 0.0
+            print(f"[hosts] {host}: {fetches} fetches, {size / 2**20:.1f} MB, "
+                  f"{seconds / fetches * 1000:.0f} ms/fetch, {rate:.0f} KB/s")
 
     async def crawl(self):
-        connector = aiohttp.TCPConnector(limit=100)
-        async with aiohttp.ClientSession(connector=connector) as self.session:
-            tasks = [asyncio.create_task(self.worker()) for _ in range(self.concurrent_tasks)]
-            await self.frontier.join()
-            for t in tasks:
-                t.cancel()
+        # One keep-alive pool per host, as large as the frontier lets a host
+        # be fetched from concurrently
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrent_tasks,
+            limit_per_host=self.frontier.host_connections,
+            use_dns_cache=True, ttl_dns_cache=DNS_CACHE_SECONDS,
+            keepalive_timeout=KEEPALIVE_SECONDS)
+        timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT, sock_connect=CONNECT_TIMEOUT,
+                                        sock_read=READ_TIMEOUT)
+        self.parser_pool = ProcessPoolExecutor(self.parse_workers)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as self.session:
+                tasks = [asyncio.create_task(self.worker()) for _ in range(self.concurrent_tasks)]
+                await asyncio.gather(*tasks)
+        finally:
+            self.parser_pool.shutdown()
+        self.incremental_update()
+        await asyncio.get_running_loop().run_in_executor(None, self.output.close)
+        self.validators.close()
+        print(f"[update] wrote {self.output.pages_written} pages to {self.output.directory}/, "
+              f"{self.pages_unchanged} unchanged, {self.pages_truncated} truncated")
+        self.report_hosts()
 
 def main():
+    parser = argparse.ArgumentParser(description="Crawl political ideology pages.")
+    parser.add_argument("--output", default=None,
+                        help=f"directory for page shards and crawl state (default: {CRAWL_DIR}, "
+                             f"or {REFRESH_DIR} with --refresh)")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint in --output")
+    parser.add_argument("--refresh", action="store_true",
+                        help="revisit every url in the validators shelf, writing only changed pages; "
+                             "apply them with update_sklearn_index.py")
+    parser.add_argument("--validators", default=None,
+                        help="validators shelf of an earlier crawl (default: inside --output, "
+                             f"or inside {CRAWL_DIR} with --refresh)")
+    args = parser.parse_args()
+    output_dir = args.output or (REFRESH_DIR if args.refresh else CRAWL_DIR)
+    validators_path = args.validators
+    if args.refresh:
+        validators_path = validators_path or os.path.join(CRAWL_DIR, VALIDATORS)
+        # Changed pages go to their own directory: appended to the crawl they
+        # refresh, the build would keep each url's first, stale record.
+        if os.path.abspath(os.path.dirname(validators_path)) == os.path.abspath(output_dir):
+            parser.error("--refresh needs an --output other than the crawl it refreshes")
+
     seeds = [
         "https://byjus.com/free-ias-prep/political-ideologies-types-definitions/",
         "https://en.wikipedia.org/wiki/Ideology",
@@ -326,7 +414,11 @@ def main():
         seeds=seeds,
         max_pages=1000,
         concurrent_tasks=50,
-        incremental_interval=1000
+        incremental_interval=1000,
+        output_dir=output_dir,
+        resume=args.resume,
+        refresh=args.refresh,
+        validators_path=validators_path,
     )
     start = time.time()
     asyncio.run(crawler.crawl())
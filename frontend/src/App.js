@@ -1,15 +1,43 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './App.css';
 import ResultItem from './components/ResultItem';
 import ParticlesBackground from './components/ParticlesBackground';
 
+// Typing pause before completions are requested
+const SUGGEST_DEBOUNCE_MS = 120;
+
+const RANKING_LABELS = {
+  vector_space: 'Vector Space',
+  pagerank: 'PageRank',
+  hits: 'HITS',
+  query_hits: 'HITS (query subgraph)',
+  lsa: 'LSA (semantic)',
+};
 
 function App() {
   const [query, setQuery] = useState('');
   const [results, setResults] = useState({ custom: [], google: [], bing: [] });
   const [loading, setLoading] = useState(false);
   const [ranking, setRanking] = useState('vector_space');
-
+  const [suggestions, setSuggestions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  // Algorithms the loaded index supports; LSA only when it has embeddings
+  const [rankings, setRankings] = useState(['vector_space', 'pagerank', 'hits', 'query_hits']);
+  // Pending completion timer and the request in flight, replaced by each keystroke
+  const suggestTimer = useRef(null);
+  const suggestRequest = useRef(null);
+
+  useEffect(() => {
+    fetch('http://127.0.0.1:5000/api/capabilities')
+      .then((res) => res.json())
+      .then((data) => setRankings(data.ranking_algorithms))
+      .catch(() => {});
+  }, []);
+
+  useEffect(() => () => {
+    clearTimeout(suggestTimer.current);
+    if (suggestRequest.current) suggestRequest.current.abort();
+  }, []);
 
   const handleSearch = async () => {
     setLoading(true);
@@ -19,10 +47,59 @@ function App() {
       body: JSON.stringify({ query, ranking_algorithm: ranking })
     });
     const data = await res.json();
-    setResults(data);
+    if (res.ok) {
+      setResults(data);
+      setNextCursor(data.next_cursor);
+    } else {
+      setResults({ custom: [], google: [], bing: [] });
+      setNextCursor(null);
+    }
     setLoading(false);
   };
 
+  const handleMore = async () => {
+    setLoading(true);
+    const res = await fetch('http://127.0.0.1:5000/api/search', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ cursor: nextCursor })
+    });
+    const data = await res.json();
+    if (res.ok) {
+      setResults({ ...results, custom: [...results.custom, ...data.custom] });
+      setNextCursor(data.next_cursor);
+    } else {
+      setNextCursor(null);
+    }
+    setLoading(false);
+  };
+
+  const handleQueryChange = (value) => {
+    setQuery(value);
+    clearTimeout(suggestTimer.current);
+    if (suggestRequest.current) suggestRequest.current.abort();
+    if (!value.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    suggestTimer.current = setTimeout(async () => {
+      // A later keystroke aborts this request, so an older prefix's slow
+      // reply never replaces the completions of the current input
+      const controller = new AbortController();
+      suggestRequest.current = controller;
+      try {
+        const res = await fetch(`http://127.0.0.1:5000/api/suggest?q=${encodeURIComponent(value)}`,
+                                { signal: controller.signal });
+        const data = await res.json();
+        if (!controller.signal.aborted) {
+          setSuggestions(data.suggestions);
+        }
+      } catch (e) {
+        // Aborted, or the backend is unreachable; keep the last completions
+      }
+    }, SUGGEST_DEBOUNCE_MS);
+  };
+
   return (
     <div className="App">
       <ParticlesBackground />
@@ -35,9 +112,15 @@ function App() {
         <input
           type="text"
           value={query}
-          onChange={(e) => setQuery(e.target.value)}
+          onChange={(e) => handleQueryChange(e.target.value)}
           placeholder="Enter a query..."
+          list="query-suggestions"
         />
+        <datalist id="query-suggestions">
+          {suggestions.map((suggestion, i) => (
+            <option key={i} value={suggestion} />
+          ))}
+        </datalist>
         <button onClick={handleSearch}>Search</button>
       </div>
 
@@ -48,9 +131,9 @@ function App() {
           value={ranking}
           onChange={(e) => setRanking(e.target.value)}
         >
-          <option value="vector_space">Vector Space</option>
-          <option value="pagerank">PageRank</option>
-          <option value="hits">HITS</option>
+          {rankings.map((name) => (
+            <option key={name} value={name}>{RANKING_LABELS[name] || name}</option>
+          ))}
         </select>
       </div>
 
@@ -63,6 +146,7 @@ function App() {
           {results.custom.map((res, i) => (
             <ResultItem key={i} title={res.title} url={res.url} snippet={res.snippet} />
           ))}
+          {nextCursor && !loading && <button onClick={handleMore}>More results</button>}
         </div>
 
         <div className="results-pane">